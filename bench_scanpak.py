@@ -0,0 +1,1305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks and load tests for the СканПак client.
+
+Run:     python bench_scanpak.py [scenario ...] [--json out.json] [--compare old.json]
+Load:    python bench_scanpak.py load --history-rows 1000000 --error-rate 0.02 --json load.json
+Display: xvfb-run python bench_scanpak.py ui load   (Tk timings are skipped without a display)
+
+Scenarios that assert invariants report them under "checks"; any failed check makes the run exit 1.
+"""
+from __future__ import annotations
+
+import argparse
+import bisect
+import gzip
+import inspect
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections.abc import Sequence
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Iterator
+from urllib.parse import parse_qs, urlparse
+
+import registry_tsd as app
+
+
+class SyntheticHistory(Sequence[dict[str, Any]]):
+    """Read-only history of ``rows`` records generated on demand, oldest first."""
+
+    START = 1_700_000_000
+
+    def __init__(self, rows: int, users: int = 200, start: int = 0) -> None:
+        self.rows, self.users, self.start = rows, users, start
+
+    def __len__(self) -> int:
+        return self.rows - self.start
+
+    def __getitem__(self, key: int | slice) -> Any:
+        if isinstance(key, slice):
+            lo, hi, _ = key.indices(len(self))
+            return SyntheticHistory(self.start + max(lo, hi), self.users, self.start + lo)
+        if not -len(self) <= key < len(self):
+            raise IndexError(key)
+        i = self.start + key % len(self)
+        return {
+            "parcel_number": str(10**13 + i * 2_654_435_761 % (9 * 10**13)),
+            "username": f"operator{i * 7919 % self.users}",
+            "scanned_at": datetime.fromtimestamp(self.START + i * 7).isoformat(),
+        }
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return (self[i] for i in range(len(self)))
+
+
+class StubServer:
+    """Local stand-in for the /scanpak API.
+
+    ``history`` may be a list of records or a SyntheticHistory ordered by
+    scanned_at. With ``ignore_paging`` a paginated stub answers every page with
+    the whole history, as a server that drops limit/offset would, and with
+    ``page_cap`` it serves at most that many rows per page and reports the
+    ``total`` in the envelope. ``faults`` is
+    the share of requests answered with 503 or, half of the time, processed and
+    then dropped without a response. With ``require_auth`` everything but
+    /login needs the token /login hands out.
+    """
+
+    TOKEN = "bench-token"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        history: list[dict[str, Any]] | SyntheticHistory | None = None,
+        paginate: bool = False,
+        bare_pages: bool = False,
+        ignore_paging: bool = False,
+        page_cap: int = 0,
+        batch: bool = False,
+        faults: float = 0.0,
+        track_keys: bool = True,
+        require_auth: bool = False,
+        port: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.history = history or []
+        self.paginate = paginate
+        self.bare_pages = bare_pages
+        self.ignore_paging = ignore_paging
+        self.page_cap = page_cap
+        self.batch = batch
+        self.faults = faults
+        self.rng = random.Random(42)
+        self.posts = 0
+        self.gets = 0
+        self.gzipped = 0
+        self.keys: dict[str, int] = {}
+        self.track_keys = track_keys
+        self.require_auth = require_auth
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *_args: Any) -> None:
+                pass
+
+            def _reply(self, status: int, body: Any) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if len(data) >= 1024 and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                    data = gzip.compress(data, 5)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, items: Sequence[dict[str, Any]], etag: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("ETag", etag)
+                self.end_headers()
+                for start in range(0, max(len(items), 1), 2000):
+                    part = ",".join(json.dumps(r) for r in items[start:start + 2000])
+                    data = (("[" if start == 0 else ",") + part + ("]" if start + 2000 >= len(items) else "")).encode()
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _authorized(self) -> bool:
+                if not stub.require_auth or self.headers.get("Authorization") == f"Bearer {stub.TOKEN}":
+                    return True
+                self._reply(401, {"detail": "unauthorized"})
+                return False
+
+            def _fault(self) -> str:
+                with stub.lock:
+                    roll = stub.rng.random()
+                return "" if roll >= stub.faults else "503" if roll < stub.faults / 2 else "drop"
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub.lock:
+                    stub.gets += 1
+                fault = self._fault()
+                if fault:
+                    self._reply(503, {"detail": "injected"}) if fault == "503" else setattr(self, "close_connection", True)
+                    return
+                if url.path != "/scanpak/history":
+                    self._reply(404, {"detail": "not found"})
+                    return
+                if not self._authorized():
+                    return
+                etag = f'"{len(stub.history)}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                items = stub.history
+                if query.get("since"):
+                    items = items[bisect.bisect_left(items, query["since"], key=lambda r: r["scanned_at"]):]
+                if not stub.paginate:
+                    self._stream(items, etag)
+                    return
+                offset, limit = int(query.get("offset") or 0), int(query.get("limit") or 100)
+                if stub.page_cap:
+                    limit = min(limit, stub.page_cap)
+                page = list(items if stub.ignore_paging else items[offset:offset + limit])
+                envelope = {"items": page, "total": len(items)} if stub.page_cap else {"items": page}
+                self._reply(200, page if stub.bare_pages else envelope)
+
+            def do_POST(self) -> None:
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Encoding") == "gzip":
+                    raw = gzip.decompress(raw)
+                    with stub.lock:
+                        stub.gzipped += 1
+                payload = json.loads(raw or b"{}")
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub.lock:
+                    stub.posts += 1
+                fault = self._fault()
+                if fault == "503":
+                    self._reply(503, {"detail": "injected"})
+                    return
+                if fault:
+                    self.close_connection = True  # processed, but the reply is lost
+                if self.path == "/scanpak/login":
+                    if not fault:
+                        self._reply(200, {"token": stub.TOKEN, "surname": payload.get("surname"), "role": "operator"})
+                elif not self._authorized():
+                    return
+                elif self.path == "/scanpak/scans":
+                    key = self.headers.get("Idempotency-Key") or ""
+                    with stub.lock:
+                        if stub.track_keys:
+                            stub.keys[key] = stub.keys.get(key, 0) + 1
+                    if not fault:
+                        self._reply(200, {"parcel_number": payload.get("parcel_number"), "username": "bench"})
+                elif self.path == "/scanpak/scans/batch" and stub.batch:
+                    with stub.lock:
+                        for item in payload.get("scans") or [] if stub.track_keys else []:
+                            stub.keys[item["idempotency_key"]] = stub.keys.get(item["idempotency_key"], 0) + 1
+                    if not fault:
+                        self._reply(200, [{"parcel_number": item["parcel_number"], "username": "bench"} for item in payload.get("scans") or []])
+                elif not fault:
+                    self._reply(404, {"detail": "not found"})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.handle_error = lambda *_args: None  # clients hang up on cancelled loads
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _check(result: dict[str, Any], **conditions: Any) -> None:
+    """Record pass/fail invariants; main() exits non-zero if any of them failed."""
+    result.setdefault("checks", {}).update({name: bool(ok) for name, ok in conditions.items()})
+
+
+def _timed(fn: Callable[[], Any], n: int) -> dict[str, float]:
+    samples = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 4),
+        "max_ms": round(samples[-1], 4),
+    }
+
+
+def bench_queue(rows: int = 100_000, ops: int = 1000) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.sqlite3"
+        app.OfflineQueue(db_path).open()
+        now = datetime.now().isoformat()
+        with sqlite3.connect(db_path) as db:
+            db.executemany(
+                "INSERT INTO pending_scans(parcel_number, created_at) VALUES(?,?)",
+                ((str(10_000_000_000 + i), now) for i in range(rows)),
+            )
+        q = app.OfflineQueue(db_path)
+        counter = iter(range(20_000_000_000, 30_000_000_000))
+        probe = iter(range(10_000_000_000, 10_000_000_000 + rows))
+        return {
+            "rows": rows,
+            "add": _timed(lambda: q.add(str(next(counter))), ops),
+            "contains": _timed(lambda: q.contains(str(next(probe))), ops),
+            "count": _timed(q.count, ops),
+        }
+
+
+def bench_sync(rows: int = 2000, latency: float = 0.01) -> dict[str, Any]:
+    result: dict[str, Any] = {"rows": rows, "latency_s": latency}
+    server = StubServer(latency)
+    try:
+        for workers in (1, app.SYNC_WORKERS, 16):
+            with tempfile.TemporaryDirectory() as tmp:
+                q = app.OfflineQueue(Path(tmp) / "bench.sqlite3")
+                for i in range(rows):
+                    q.add(str(40_000_000_000 + i))
+                api = app.ApiClient(server.url)
+                t0 = time.perf_counter()
+                sent = app.SyncEngine(q, api, workers).drain()
+                elapsed = time.perf_counter() - t0
+                result[f"workers_{workers}"] = {"sent": sent, "rows_per_s": round(sent / elapsed, 1), "left": q.count()}
+        result["duplicate_posts"] = sum(n - 1 for n in server.keys.values())
+    finally:
+        server.close()
+    _check(result,
+           no_duplicate_posts=result["duplicate_posts"] == 0,
+           drained=all(result[k]["left"] == 0 and result[k]["sent"] == rows for k in result if k.startswith("workers_")))
+    return result
+
+
+def bench_dupindex(known: int = 1_000_000, ops: int = 2000) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.sqlite3"
+        index = app.DuplicateIndex(db_path)
+        t0 = time.perf_counter()
+        for start in range(0, known, 100_000):
+            index.add_many(str(50_000_000_000 + i) for i in range(start, min(known, start + 100_000)))
+        result: dict[str, Any] = {"known": known, "load_s": round(time.perf_counter() - t0, 2)}
+        index = app.DuplicateIndex(db_path)
+        probe = iter(range(50_000_000_000, 50_000_000_000 + known))
+        miss = iter(range(60_000_000_000, 70_000_000_000))
+        result["contains_cold_hit"] = _timed(lambda: index.contains(str(next(probe))), ops)
+        t0 = time.perf_counter()
+        index.warm()
+        result["warm_rebuild_s"] = round(time.perf_counter() - t0, 2)
+        index = app.DuplicateIndex(db_path)
+        t0 = time.perf_counter()
+        index.warm()
+        result["warm_persisted_s"] = round(time.perf_counter() - t0, 2)
+        result["bloom_bytes"] = len(index._bloom.bits) if index._bloom else 0
+        result["contains_hit"] = _timed(lambda: index.contains(str(next(probe))), ops)
+        result["contains_miss"] = _timed(lambda: index.contains(str(next(miss))), ops)
+        result["begin_finish"] = _timed(lambda: index.finish(n := str(next(miss)), index.begin(n)), ops)
+        other = app.DuplicateIndex(db_path)  # a second process (--import, another app copy) on the same file
+        other.add("222")
+        app.OfflineQueue(db_path, other).add("333")
+        result["sees_other_instance"] = index.contains("222") and index.contains("333")
+    records = _history_records(50)
+    server = StubServer(history=records)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = app.DuplicateIndex(Path(tmp) / "bench.sqlite3")
+            mirror = app.HistoryMirror(Path(tmp) / "bench.sqlite3", index)
+            api = app.ApiClient(server.url)
+            mirror.refresh(api)
+            victim = records[10]["parcel_number"]
+            server.history = records[:10] + records[11:]
+            mirror.refresh(api)
+            kept_after_cursor_refresh = index.contains(victim)
+            mirror.refresh(api, full=True)
+            gets = server.gets
+            unchanged = not mirror.refresh(api, full=True)
+            result["server_delete"] = {
+                "kept_after_cursor_refresh": kept_after_cursor_refresh,
+                "mirror_rows_after_full": sum(1 for _ in mirror.rows()),
+                "duplicate_after_full": index.contains(victim),
+                "full_recheck_requests": server.gets - gets,
+                "full_recheck_unchanged": unchanged,
+            }
+    finally:
+        server.close()
+    capped = _history_records(3000)
+    server = StubServer(history=capped, paginate=True, page_cap=1000)
+    max_pages = app.HISTORY_MAX_PAGES
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = app.DuplicateIndex(Path(tmp) / "bench.sqlite3")
+            mirror = app.HistoryMirror(Path(tmp) / "bench.sqlite3", index)
+            api = app.ApiClient(server.url)
+            mirror.refresh(api)
+            app.HISTORY_MAX_PAGES = 1  # stands in for any load that stops short of the envelope's total
+            mirror.refresh(api, full=True)
+            result["incomplete_full"] = {
+                "mirror_rows": sum(1 for _ in mirror.rows()),
+                "last_still_duplicate": index.contains(capped[-1]["parcel_number"]),
+            }
+            app.OfflineQueue(Path(tmp) / "bench.sqlite3", index).add("444")
+            mirror.clear()  # logout, or a refresh for another account
+            result["owner_change"] = {"old_numbers_forgotten": not index.contains(capped[0]["parcel_number"]), "queued_kept": index.contains("444")}
+    finally:
+        app.HISTORY_MAX_PAGES = max_pages
+        server.close()
+    _check(result,
+           sees_other_instance=result["sees_other_instance"],
+           full_refresh_drops_deleted=result["server_delete"]["mirror_rows_after_full"] == len(records) - 1,
+           deleted_scan_allowed_again=not result["server_delete"]["duplicate_after_full"],
+           full_recheck_conditional=result["server_delete"]["full_recheck_requests"] == 1 and result["server_delete"]["full_recheck_unchanged"],
+           owner_change_resets_index=result["owner_change"]["old_numbers_forgotten"] and result["owner_change"]["queued_kept"],
+           incomplete_full_keeps_rows=result["incomplete_full"]["mirror_rows"] == len(capped) and result["incomplete_full"]["last_still_duplicate"])
+    return result
+
+
+def _history_records(rows: int, users: int = 200) -> list[dict[str, Any]]:
+    rnd = random.Random(rows)
+    names = [f"operator{i}" for i in range(users)]
+    start = 1_700_000_000
+    return [
+        {
+            "parcel_number": str(rnd.randrange(10**13, 10**14)),
+            "username": rnd.choice(names),
+            "scanned_at": datetime.fromtimestamp(start + i * 7).isoformat(),
+        }
+        for i in range(rows)
+    ]
+
+
+def _history_rows(records: list[dict[str, Any]]) -> list[tuple[str, str, str, float]]:
+    return [(r["parcel_number"], r["username"], r["scanned_at"], app.to_epoch(r["scanned_at"])) for r in records]
+
+
+def bench_search(rows: int = 500_000) -> dict[str, Any]:
+    source = _history_rows(_history_records(rows))
+    t0 = time.perf_counter()
+    model = app.HistoryStore.from_rows(source)
+    result: dict[str, Any] = {"rows": rows, "build_s": round(time.perf_counter() - t0, 2)}
+    target = model[rows // 2][2]
+    for label, typed in (("number", target[:8]), ("user", "operator17")):
+        keystrokes = []
+        for end in range(1, len(typed) + 1):
+            inline = model.plan(typed[:end]) <= app.SEARCH_INLINE_ROWS
+            t0 = time.perf_counter()
+            hits = len(model.filter(typed[:end]))
+            keystrokes.append({"query": typed[:end], "ms": round((time.perf_counter() - t0) * 1000, 2), "hits": hits, "inline": inline})
+        result[label] = keystrokes
+    t0 = time.perf_counter()
+    model.filter("")
+    model.filter(target[3:9])
+    result["cold_token_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return result
+
+
+def bench_history(rows: int = 200_000) -> dict[str, Any]:
+    result: dict[str, Any] = {"rows": rows}
+    records = _history_records(rows)
+    modes = ("stream", "paged", "paged_array", "capped_total", "unpaged_items", "unpaged_array")
+    for mode in modes:
+        server = StubServer(
+            history=records, paginate=mode != "stream", bare_pages=mode.endswith("_array"),
+            ignore_paging=mode.startswith("unpaged"), page_cap=app.HISTORY_PAGE // 5 if mode.startswith("capped") else 0,
+        )
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                mirror = app.HistoryMirror(Path(tmp) / "bench.sqlite3")
+                api = app.ApiClient(server.url)
+                first: list[float] = []
+                t0 = time.perf_counter()
+                mirror.refresh(api, lambda _n: first or first.append(time.perf_counter() - t0))
+                full = time.perf_counter() - t0
+                t0 = time.perf_counter()
+                store = app.HistoryStore.from_rows(mirror.rows())
+                render = time.perf_counter() - t0
+                requests_ = server.gets
+                t0 = time.perf_counter()
+                unchanged = mirror.refresh(api)
+                result[mode] = {
+                    "requests": requests_,
+                    "first_chunk_s": round(first[0], 3),
+                    "full_load_s": round(full, 2),
+                    "store_build_s": round(render, 2),
+                    "rows": len(store),
+                    "conditional_refresh_ms": round((time.perf_counter() - t0) * 1000, 1),
+                    "unchanged": not unchanged,
+                }
+        finally:
+            server.close()
+    _check(result,
+           all_rows_loaded=all(result[mode]["rows"] == len(records) for mode in modes),
+           unpaged_fetched_once=all(result[mode]["requests"] == 1 for mode in modes if mode.startswith("unpaged")))
+    return result
+
+
+def bench_dispatch(scans: int = 200, latency: float = 0.02, interval: float = 0.05) -> dict[str, Any]:
+    """Scan-to-status latency with sync and history traffic competing for workers."""
+    result: dict[str, Any] = {"scans": scans, "latency_s": latency, "interval_s": interval}
+    server = StubServer(latency, history=_history_records(50_000))
+    try:
+        for mode in ("lanes", "thread_per_task_80ms_poll"):
+            wake = threading.Event()
+            ui = app.UiDispatcher(wake.set)
+            lanes = app.TaskLanes(app.TASK_LANES)
+            samples: list[float] = []
+            stop = threading.Event()
+
+            def ui_loop() -> None:
+                while not stop.is_set():
+                    if mode == "lanes":
+                        wake.wait(0.5)
+                        wake.clear()
+                    else:
+                        time.sleep(0.08)
+                    ui.drain()
+
+            def submit(work: Callable[[], Any], done: Callable[[Any], None], lane: str) -> None:
+                def run() -> None:
+                    try:
+                        res = work()
+                    except Exception as exc:
+                        res = exc
+                    ui.put(lambda: done(res))
+                if mode == "lanes":
+                    lanes.submit(lane, run)
+                else:
+                    threading.Thread(target=run, daemon=True).start()
+
+            threading.Thread(target=ui_loop, daemon=True).start()
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = Path(tmp) / "bench.sqlite3"
+                queue_ = app.OfflineQueue(db_path)
+                for i in range(2000):
+                    queue_.add(str(70_000_000_000 + i))
+                mirror = app.HistoryMirror(db_path)
+                api = app.ApiClient(server.url)
+                submit(lambda: queue_.sync(api), lambda _r: None, "misc")
+                submit(lambda: mirror.refresh(api), lambda _r: None, "history")
+                finished = threading.Semaphore(0)
+                for i in range(scans):
+                    t0 = time.perf_counter()
+                    submit(
+                        lambda n=i: api.add_scan(str(80_000_000_000 + n)),
+                        lambda _r, t0=t0: (samples.append((time.perf_counter() - t0) * 1000), finished.release()),
+                        "scan",
+                    )
+                    time.sleep(interval)
+                for _ in range(scans):
+                    finished.acquire(timeout=60)
+            stop.set()
+            wake.set()
+            samples.sort()
+            result[mode] = {
+                "completed": len(samples),
+                "p50_ms": round(statistics.median(samples), 1),
+                "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 1),
+                "lanes": lanes.stats() if mode == "lanes" else None,
+            }
+    finally:
+        server.close()
+    scan_lane = result["lanes"]["lanes"]["scan"]
+    _check(result,
+           all_scans_completed=all(result[mode]["completed"] == scans for mode in ("lanes", "thread_per_task_80ms_poll")),
+           lanes_beat_polling=result["lanes"]["p95_ms"] < result["thread_per_task_80ms_poll"]["p95_ms"],
+           scan_lane_drained=scan_lane["queued"] == 0 and scan_lane["done"] == scans)
+    return result
+
+
+def bench_pipeline(scans: int = 500, latency: float = 0.02) -> dict[str, Any]:
+    result: dict[str, Any] = {"scans": scans, "latency_s": latency}
+    for batch in (False, True):
+        server = StubServer(latency, batch=batch)
+        lanes = app.TaskLanes({"scan": app.TASK_LANES["scan"]})
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = Path(tmp) / "bench.sqlite3"
+                index = app.DuplicateIndex(db_path)
+                pipeline = app.ScanPipeline(app.ApiClient(server.url), index, app.OfflineQueue(db_path, index), lambda fn: lanes.submit("scan", fn))
+                finished = threading.Semaphore(0)
+                t0 = time.perf_counter()
+                accept = _timed(lambda n=iter(range(scans)): pipeline.accept(str(90_000_000_000 + next(n)), lambda _r, _e: finished.release()), scans)
+                rejected = sum(not pipeline.accept(str(90_000_000_000 + i), lambda _r, _e: None) for i in range(0, scans, 10))
+                completed = sum(finished.acquire(timeout=60) for _ in range(scans))
+                elapsed = time.perf_counter() - t0
+            result["batch" if batch else "single"] = {
+                "accept": accept,
+                "completed": completed,
+                "scans_per_s": round(scans / elapsed, 1),
+                "posts": server.posts,
+                "inflight_duplicates_rejected": rejected,
+            }
+        finally:
+            server.close()
+    _check(result,
+           all_scans_completed=all(result[mode]["completed"] == scans for mode in ("single", "batch")),
+           inflight_duplicates_rejected=all(result[mode]["inflight_duplicates_rejected"] == scans // 10 for mode in ("single", "batch")),
+           batch_sends_fewer_posts=result["batch"]["posts"] < result["single"]["posts"])
+    return result
+
+
+def bench_transport(calls: int = 300, latency: float = 0.005, faults: float = 0.1) -> dict[str, Any]:
+    """Retries, gzip and pooling against a stub that injects latency and faults."""
+    result: dict[str, Any] = {"calls": calls, "latency_s": latency, "faults": faults}
+    server = StubServer(latency, history=_history_records(500), paginate=True, batch=True, faults=faults)
+    try:
+        for retries in (0, app.HTTP_RETRIES):
+            samples: list[dict[str, Any]] = []
+            transport = app.Transport(retries=retries, retry_delay=0.005)
+            transport.hooks.append(samples.append)
+            api = app.ApiClient(server.url, transport)
+            calls_by_kind: dict[str, Callable[[int], Any]] = {
+                "get_history": lambda i: api._request("GET", "/history", params={"limit": 100, "offset": i % 5 * 100}),
+                "post_keyed": lambda i: api.add_scan(str(50_000_000_000 + i), uuid.uuid4().hex),
+                "post_plain": lambda i: api.add_scan(str(60_000_000_000 + i)),
+            }
+            outcome: dict[str, Any] = {}
+            for kind, call in calls_by_kind.items():
+                ok, before = 0, len(samples)
+                for i in range(calls):
+                    try:
+                        call(i)
+                        ok += 1
+                    except app.ApiError:
+                        pass
+                outcome[kind] = {"success": round(ok / calls, 3), "attempts": len(samples) - before}
+            result[f"retries_{retries}"] = outcome
+        for endpoint in ("/history", "/scans"):
+            done = sorted(s["total_ms"] for s in samples if s["endpoint"] == endpoint and s["status"] == 200)
+            ttfb = sorted(s["ttfb_ms"] for s in samples if s["endpoint"] == endpoint and s["status"] == 200)
+            result[endpoint] = {"ttfb_p50_ms": round(statistics.median(ttfb), 2), "total_p50_ms": round(statistics.median(done), 2)}
+        fresh = [s for s in samples if s["connect_ms"]]
+        result["new_connections"] = {
+            "count": len(fresh),
+            "dns_p50_ms": round(statistics.median(s["dns_ms"] for s in fresh), 3) if fresh else None,
+            "connect_p50_ms": round(statistics.median(s["connect_ms"] for s in fresh), 3) if fresh else None,
+        }
+        server.faults = 0.0
+        items = [(str(70_000_000_000 + i), uuid.uuid4().hex) for i in range(app.SCAN_BATCH)]
+        payload = json.dumps({"scans": [{"parcel_number": n, "idempotency_key": k} for n, k in items]}, separators=(",", ":")).encode()
+        api.add_scans(items)
+        result["gzip_batch"] = {"raw_bytes": len(payload), "gzip_bytes": len(gzip.compress(payload, 5)), "server_saw_gzip": server.gzipped}
+        for pool in (4, 16):
+            samples = []
+            transport = app.Transport(pool_size=pool)
+            transport.hooks.append(samples.append)
+            api = app.ApiClient(server.url, transport)
+            threads = [threading.Thread(target=lambda: [api._request("GET", "/history", params={"limit": 10, "offset": 0}) for _ in range(20)]) for _ in range(16)]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            result[f"pool_{pool}_16_threads"] = {"connections_opened": sum(1 for s in samples if s["connect_ms"]), "elapsed_s": round(time.perf_counter() - t0, 3)}
+    finally:
+        server.close()
+    result["dns_failure_down"] = {}
+    for label, hooks in (("plain", []), ("hooked", [lambda _s: None])):  # telemetry must not change how failures are handled
+        transport = app.Transport(retries=0)
+        transport.hooks.extend(hooks)
+        transport.link = app.LinkMonitor()
+        try:
+            transport.request("GET", "http://scanpak-bench.invalid/scanpak/history")
+        except Exception:
+            pass
+        result["dns_failure_down"][label] = transport.link.down
+    retried = result[f"retries_{app.HTTP_RETRIES}"]
+    _check(result,
+           post_plain_never_retried=retried["post_plain"]["attempts"] == calls,
+           get_retried_to_success=retried["get_history"]["success"] >= 0.98,
+           post_keyed_retried_to_success=retried["post_keyed"]["success"] >= 0.98,
+           batch_sent_gzipped=result["gzip_batch"]["server_saw_gzip"] > 0,
+           dns_failure_opens_link=all(result["dns_failure_down"].values()))
+    return result
+
+
+_IMPORT_CTRL_C = r"""
+import _thread, json, sys, threading
+from pathlib import Path
+import registry_tsd as app
+path, db_path, url = sys.argv[1:4]
+index = app.DuplicateIndex(Path(db_path))
+threading.Timer(1.0, _thread.interrupt_main).start()  # Ctrl-C one second into a paced run
+print(json.dumps(app.bulk_import(path, app.ApiClient(url), index, app.OfflineQueue(Path(db_path), index), rate=20)), flush=True)
+"""
+
+
+def bench_import(rows: int = 100_000, latency: float = 0.01) -> dict[str, Any]:
+    """Headless import of a CSV with repeats; peak traced memory should not grow with the file."""
+    result: dict[str, Any] = {"rows": rows, "latency_s": latency}
+    server = StubServer(latency, batch=True, track_keys=False)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "scans.csv"
+            with path.open("w", encoding="utf-8") as fh:
+                fh.write("date;number;note\n")
+                for i in range(rows):
+                    fh.write(f"2026-10-16;{20_000_000_000 + i % (rows * 3 // 4)};ok\n")
+            result["file_mb"] = round(path.stat().st_size / 2**20, 1)
+            db_path = Path(tmp) / "bench.sqlite3"
+            index = app.DuplicateIndex(db_path)
+            index.warm()
+            tracemalloc.start()
+            summary = app.bulk_import(str(path), app.ApiClient(server.url), index, app.OfflineQueue(db_path, index), rate=0)
+            result["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+            result.update({k: summary[k] for k in ("sent", "offline", "duplicates", "elapsed_s", "per_s")})
+            result["posts"] = server.posts
+            try:
+                proc = subprocess.run(
+                    [sys.executable, "-c", _IMPORT_CTRL_C, str(path), str(db_path), server.url],
+                    capture_output=True, text=True, timeout=30, cwd=Path(__file__).parent,
+                )
+                summary = json.loads(proc.stdout.strip().splitlines()[-1])
+                result["ctrl_c"] = {"interrupted": summary["interrupted"], "returned_s": summary["elapsed_s"]}
+            except (subprocess.TimeoutExpired, IndexError, ValueError):
+                result["ctrl_c"] = {"interrupted": True, "returned_s": None}  # hung on the permits, or crashed
+    finally:
+        server.close()
+    _check(result, ctrl_c_returns=result["ctrl_c"]["returned_s"] is not None and result["ctrl_c"]["interrupted"])
+    return result
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:  # Windows
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t)
+                for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                             "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+            ]
+
+        counters = Counters(cb=ctypes.sizeof(Counters))
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return round(counters.PeakWorkingSetSize / 2**20, 1)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def _percentiles(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    if not samples:
+        return {"p50_ms": 0.0, "p95_ms": 0.0}
+    return {"p50_ms": round(statistics.median(samples), 2), "p95_ms": round(samples[max(0, int(len(samples) * 0.95) - 1)], 2)}
+
+
+def bench_load(
+    scans: int = 2000, latency: float = 0.02, faults: float = 0.02, history_rows: int = 200_000, sync_rows: int = 2000
+) -> dict[str, Any]:
+    """End-to-end load test against the stub: login, scan burst, offline drain, history load and render.
+
+    peak_rss_mb is the process-wide peak, so run this scenario on its own for a clean figure.
+    """
+    result: dict[str, Any] = {"scans": scans, "latency_s": latency, "faults": faults, "history_rows": history_rows}
+    server = StubServer(latency, history=SyntheticHistory(history_rows), batch=True, require_auth=True, track_keys=False)
+    lanes = app.TaskLanes({"scan": app.TASK_LANES["scan"]})
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "bench.sqlite3"
+            api = app.ApiClient(server.url)
+            t0 = time.perf_counter()
+            api.login("bench", "secret")
+            result["login_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            server.faults = faults
+
+            index = app.DuplicateIndex(db_path)
+            offline = app.OfflineQueue(db_path, index)
+            pipeline = app.ScanPipeline(api, index, offline, lambda fn: lanes.submit("scan", fn))
+            latencies: list[float] = []
+            failed = [0]
+            finished = threading.Semaphore(0)
+
+            def on_result(t_accept: float) -> Callable[[Any, Exception | None], None]:
+                def done(_res: Any, err: Exception | None) -> None:
+                    latencies.append((time.perf_counter() - t_accept) * 1000)
+                    failed[0] += err is not None
+                    finished.release()
+                return done
+
+            t0 = time.perf_counter()
+            for i in range(scans):
+                pipeline.accept(str(80_000_000_000 + i), on_result(time.perf_counter()))
+            for _ in range(scans):
+                finished.acquire(timeout=120)
+            elapsed = time.perf_counter() - t0
+            result["scan"] = {"scans_per_s": round(scans / elapsed, 1), **_percentiles(latencies), "to_offline": failed[0]}
+
+            for i in range(sync_rows):
+                offline.add(str(81_000_000_000 + i))
+            queued = offline.count()
+            t0 = time.perf_counter()
+            sent = offline.sync(api)
+            elapsed = time.perf_counter() - t0
+            result["sync"] = {"queued": queued, "sent": sent, "rows_per_s": round(sent / elapsed, 1), "left": offline.count()}
+
+            mirror = app.HistoryMirror(db_path, index)
+            first: list[float] = []
+            t0 = time.perf_counter()
+            mirror.refresh(api, lambda _n: first or first.append(time.perf_counter() - t0))
+            load = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            store = app.HistoryStore.from_rows(mirror.rows())
+            build = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            view = store.filter("")
+            screen = [store[view[i]] for i in range(min(40, len(view)))]
+            render = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            hits = len(store.filter("operator17"))
+            search = time.perf_counter() - t0
+            result["history"] = {
+                "rows": len(store),
+                "first_chunk_s": round(first[0], 3) if first else None,
+                "load_s": round(load, 2),
+                "store_build_s": round(build, 2),
+                "first_screen_ms": round(render * 1000, 2),
+                "search_ms": round(search * 1000, 2),
+                "search_hits": hits,
+                "tk_render_ms": _tk_render_ms(store, view) if screen else None,
+            }
+    finally:
+        server.close()
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def _tk_render_ms(store: app.HistoryStore, view: Sequence[int]) -> float | None:
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        root.geometry("1100x700")
+        table = app.VirtualTable(root, ["dt", "user", "number"], ["Дата/час", "Користувач", "Номер"], [260, 220, 320])
+        root.update()
+        t0 = time.perf_counter()
+        table.set_view(store, view)
+        root.update_idletasks()
+        return round((time.perf_counter() - t0) * 1000, 2)
+    finally:
+        root.destroy()
+
+
+def bench_telemetry(tasks: int = 100_000, calls: int = 500) -> dict[str, Any]:
+    """Hook overhead with telemetry disabled vs enabled, plus metrics-file rotation."""
+    result: dict[str, Any] = {"tasks": tasks, "calls": calls}
+    server = StubServer()
+    try:
+        for enabled in (False, True):
+            app.metrics.enabled = enabled
+            lanes = app.TaskLanes({"bench": 1})
+            done = threading.Event()
+            t0 = time.perf_counter()
+            for _ in range(tasks - 1):
+                lanes.submit("bench", lambda: None)
+            lanes.submit("bench", done.set)
+            done.wait()
+            lane_us = (time.perf_counter() - t0) / tasks * 1e6
+            ui = app.UiDispatcher(lambda: None)
+            for _ in range(tasks):
+                ui.put(lambda: None)
+            t0 = time.perf_counter()
+            ui.drain()
+            drain_us = (time.perf_counter() - t0) / tasks * 1e6
+            api = app.ApiClient(server.url)
+            if enabled:
+                api.http.hooks.append(app.metrics.http)
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                api.get_history()
+            http_us = (time.perf_counter() - t0) / calls * 1e6
+            result["enabled" if enabled else "disabled"] = {
+                "lane_task_us": round(lane_us, 2), "ui_item_us": round(drain_us, 3), "http_call_us": round(http_us, 1),
+            }
+        t0 = time.perf_counter()
+        for i in range(tasks):
+            app.metrics.observe("bench", i % 700)
+        result["observe_us"] = round((time.perf_counter() - t0) / tasks * 1e6, 3)
+        with tempfile.TemporaryDirectory() as tmp:
+            telemetry = app.Telemetry()
+            telemetry.enable(Path(tmp) / "metrics.jsonl")
+            telemetry.observe("http POST /scans", 12.0)
+            snap = telemetry.sample(offline=0, lanes={})
+            for _ in range(app.METRICS_MAX_BYTES * (app.METRICS_BACKUPS + 2) // len(json.dumps(snap)) + 1):
+                telemetry.write(snap)
+            files = sorted(p.name for p in Path(tmp).iterdir())
+            result["rotation"] = {"files": files, "max_kb": max(p.stat().st_size for p in Path(tmp).iterdir()) // 1024}
+            telemetry.close()
+    finally:
+        app.metrics.enabled = False
+        server.close()
+    return result
+
+
+_STARTUP_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import registry_tsd as app
+import tkinter as tk
+out = {"import_ms": (time.perf_counter() - t0) * 1000, "requests_after_import": "requests" in sys.modules}
+try:
+    root = app.App(sys.argv[1])
+except tk.TclError as exc:
+    print(json.dumps({**out, "skipped": str(exc)}))
+    raise SystemExit
+def ready():
+    if not root._ready:
+        return root.after(5, ready)
+    out["ready_ms"] = (time.perf_counter() - t0) * 1000
+    root.destroy()
+def poll():
+    w = root.focus_lastfor()
+    if not (isinstance(w, tk.Entry) and w.winfo_viewable()):
+        return root.after(1, poll)
+    out["first_entry_ms"] = (time.perf_counter() - t0) * 1000
+    out["requests_at_entry"] = "requests" in sys.modules
+    ready()
+root.after(0, poll)
+root.mainloop()
+print(json.dumps(out))
+"""
+
+
+def bench_startup(runs: int = 5, history_rows: int = 200_000) -> dict[str, Any]:
+    """Cold start in a fresh interpreter: import -> first focusable scan entry -> stores and caches ready."""
+    result: dict[str, Any] = {"runs": runs, "history_rows": history_rows, "target_ms": 1000}
+    server = StubServer(0.05)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            app_dir = Path(tmp) / "ScanPak_Windows"
+            app_dir.mkdir()
+            (app_dir / "session.json").write_text(json.dumps({"token": "t", "user_name": "bench", "role": "operator"}), "utf-8")
+            db_path = app_dir / "scanpak.sqlite3"
+            mirror = app.HistoryMirror(db_path)
+            mirror.open()
+            with sqlite3.connect(db_path) as db:
+                db.executemany(
+                    "INSERT INTO history(key, parcel_number, username, scanned_at, ts) VALUES(?,?,?,?,?)",
+                    ((f"{i}", *row) for i, row in enumerate(_history_rows(list(SyntheticHistory(history_rows))))),
+                )
+            index = app.DuplicateIndex(db_path)
+            index.warm()
+            index.save()
+            del mirror, index
+            env = {**os.environ, "APPDATA": tmp}
+            samples = []
+            for _ in range(runs):
+                proc = subprocess.run([sys.executable, "-c", _STARTUP_PROBE, server.url], env=env, capture_output=True, text=True, timeout=120, cwd=Path(__file__).parent)
+                lines = proc.stdout.strip().splitlines()
+                if not lines:
+                    return {**result, "error": proc.stderr[-500:]}
+                samples.append(json.loads(lines[-1]))
+    finally:
+        server.close()
+    for key in ("import_ms", "first_entry_ms", "ready_ms"):
+        values = [s[key] for s in samples if key in s]
+        if values:
+            result[f"{key[:-3]}_p50_ms"] = round(statistics.median(values), 1)
+    result["requests_loaded_before_entry"] = any(s.get("requests_at_entry") or s.get("requests_after_import") for s in samples)
+    if "skipped" in samples[0]:
+        result["skipped"] = samples[0]["skipped"]
+    return result
+
+
+_QUEUE_WORKER = r"""
+import os, sys, time
+from pathlib import Path
+import registry_tsd as app
+role, db_path, url, arg = sys.argv[1:5]
+q = app.OfflineQueue(Path(db_path), lease=1.0 if role == "crash" else 10.0)  # the crashed lease expires quickly
+if role == "produce":
+    start, n = map(int, arg.split(":"))
+    for i in range(start, start + n):
+        q.add(str(i))
+elif role == "crash":
+    rows = q.claim(int(arg))
+    api = app.ApiClient(url)
+    for _row_id, number, key, _attempts in rows[: len(rows) // 2]:
+        api.add_scan(number, key)
+    print(len(rows) // 2, flush=True)
+    os._exit(1)
+else:
+    engine = app.SyncEngine(q, app.ApiClient(url), app.SYNC_WORKERS)
+    sent = 0
+    while not (Path(arg).exists() and q.count() == 0):
+        n = engine.drain()
+        sent += n
+        if not n:
+            time.sleep(0.05)
+    print(sent, flush=True)
+"""
+
+
+def bench_multiproc(rows: int = 20_000, producers: int = 2, consumers: int = 3, latency: float = 0.002) -> dict[str, Any]:
+    """Several processes share one queue file: producers add, consumers sync, one sender dies mid-lease."""
+    result: dict[str, Any] = {"rows": rows, "producers": producers, "consumers": consumers, "latency_s": latency}
+    server = StubServer(latency)
+    cwd = Path(__file__).parent
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "bench.sqlite3"
+            done = Path(tmp) / "producers.done"
+            seed = rows // 10
+            q = app.OfflineQueue(db_path)
+            for i in range(seed):
+                q.add(str(50_000_000_000 + i))
+
+            def spawn(role: str, arg: str) -> subprocess.Popen[str]:
+                return subprocess.Popen(
+                    [sys.executable, "-c", _QUEUE_WORKER, role, str(db_path), server.url, arg], cwd=cwd, stdout=subprocess.PIPE, text=True
+                )
+
+            crash = spawn("crash", str(seed // 2))
+            resent = int(crash.communicate(timeout=120)[0] or 0)
+            t0 = time.perf_counter()
+            share = (rows - seed) // producers
+            procs = [spawn("produce", f"{60_000_000_000 + p * share}:{share}") for p in range(producers)]
+            sinks = [spawn("consume", str(done)) for _ in range(consumers)]
+            for proc in procs:
+                proc.wait(timeout=600)
+            done.touch()
+            sent = sum(int(proc.communicate(timeout=600)[0] or 0) for proc in sinks)
+            elapsed = time.perf_counter() - t0
+            total = seed + share * producers
+            with sqlite3.connect(db_path) as db:
+                left = db.execute("SELECT COUNT(*) FROM pending_scans").fetchone()[0]
+            result.update(
+                queued=total,
+                sent=sent,
+                rows_per_s=round(sent / elapsed, 1),
+                left=left,
+                count_matches=app.OfflineQueue(db_path).count() == left == q.count(),
+                crashed_lease_rows=seed // 2,
+                resent_after_crash=resent,
+                duplicate_posts=sum(n - 1 for n in server.keys.values()),
+                unique_posted=len(server.keys),
+            )
+            _check(
+                result,
+                no_double_send=result["duplicate_posts"] <= resent,
+                drained=left == 0,
+                all_posted=result["unique_posted"] == total,
+                count_matches=result["count_matches"],
+            )
+    finally:
+        server.close()
+    return result
+
+
+def bench_link(queued: int = 20, read_timeout: float = 1.0, backoff_max: float = 4.0) -> dict[str, Any]:
+    """Server unreachable, then back: scan latency with the breaker open, probe backoff, recovery and kick-to-sent time."""
+    result: dict[str, Any] = {"queued": queued, "read_timeout_s": read_timeout, "backoff_max_s": backoff_max}
+    blackhole = socket.socket()
+    blackhole.bind(("127.0.0.1", 0)); blackhole.listen(64)  # accepts connections, never answers
+    port = blackhole.getsockname()[1]
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.sqlite3"
+        api = app.ApiClient(f"http://127.0.0.1:{port}", app.Transport(read_timeout=read_timeout))
+        api.token = StubServer.TOKEN
+        api.link.backoff_max = backoff_max
+        slow = app.Transport(read_timeout=read_timeout, retries=0)
+        slow.link = app.LinkMonitor()
+        try:
+            slow.request("GET", f"http://127.0.0.1:{port}/scanpak/history")
+        except Exception:
+            pass
+        result["one_read_timeout_down"] = slow.link.down
+        offline = app.OfflineQueue(db_path)
+        pipeline = app.ScanPipeline(api, app.DuplicateIndex(db_path), offline, lambda fn: fn(), batch_size=1)
+        samples = []
+        for i in range(queued):
+            t0 = time.perf_counter()
+            pipeline.accept(str(90_000_000_000 + i), lambda _res, _err: None)
+            samples.append((time.perf_counter() - t0) * 1000)
+        result["scan_down"] = {"first_ms": round(samples[0], 1), "rest_p50_ms": round(statistics.median(samples[1:]), 3), "to_offline": offline.count()}
+        attempts: list[dict[str, Any]] = []
+        api.http.hooks.append(attempts.append)
+        time.sleep(api.link.retry_in())
+        callers = [threading.Thread(target=lambda n=n: pipeline.accept(str(91_000_000_000 + n), lambda _res, _err: None)) for n in range(8)]
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        result["half_open"] = {"callers": len(callers), "attempts": len(attempts)}
+        blackhole.close()  # now refused outright
+        probes: list[float] = []
+        probe = api.probe
+        api.probe = lambda timeout=app.PROBE_TIMEOUT: (probes.append(time.monotonic()), probe(timeout))[1]  # type: ignore[method-assign]
+        scheduler = app.SyncScheduler(offline, api, idle=60.0)
+        scheduler.start()
+        try:
+            time.sleep(3 * backoff_max)
+            gaps = [b - a for a, b in zip(probes, probes[1:])]
+            result["down"] = {"probes": len(probes), "gaps_s": [round(g, 2) for g in gaps]}
+            server = StubServer(port=port)
+            t0 = time.perf_counter()
+            while offline.count() and time.perf_counter() - t0 < 3 * backoff_max:
+                time.sleep(0.01)
+            result["recovery_s"] = round(time.perf_counter() - t0, 2)
+            result["left"] = offline.count()
+            offline.add("99999999999")
+            t0 = time.perf_counter()
+            scheduler.kick()
+            while offline.count() and time.perf_counter() - t0 < 10:
+                time.sleep(0.001)
+            result["kick_to_sent_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            result["kick_left"] = offline.count()
+            result["idle_poll_s"] = app.SYNC_IDLE
+        finally:
+            scheduler.stop()
+            if server is not None:
+                server.close()
+    _check(result,
+           read_timeout_not_down=not result["one_read_timeout_down"],
+           down_scans_queued=result["scan_down"]["to_offline"] == queued,
+           single_half_open_trial=result["half_open"]["attempts"] == 1,
+           drained_after_recovery=result["left"] == 0,
+           kick_sends=result["kick_left"] == 0)
+    return result
+
+
+def bench_export(rows: int = 1_000_000, query: str = "operator1") -> dict[str, Any]:
+    """Stream the history view to CSV and XLSX: time, peak traced memory, filtered view and cancel latency."""
+    model = app.HistoryStore.from_rows(_history_rows(_history_records(rows)))
+    result: dict[str, Any] = {"rows": rows}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, view in (("csv", range(len(model))), ("xlsx", range(len(model))), ("csv_filtered", model.filter(query))):
+            path = Path(tmp) / f"history.{name.split('_')[0]}"
+            t0 = time.perf_counter()
+            written = app.export_history(model, view, path, app.HISTORY_HEADINGS)
+            elapsed = time.perf_counter() - t0
+            tracemalloc.start()  # second, traced pass: tracing slows formatting several times over
+            app.export_history(model, view, path, app.HISTORY_HEADINGS)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            result[name] = {
+                "rows": written, "view_rows": len(view), "s": round(elapsed, 2), "rows_per_s": round(written / elapsed), "mb": round(path.stat().st_size / 2**20, 1),
+                "peak_traced_mb": round(peak / 2**20, 1),
+            }
+        cancel = threading.Event()
+        path = Path(tmp) / "cancelled.csv"
+        path.write_text("previous export", "utf-8")
+        timer = threading.Timer(0.5, cancel.set)
+        timer.start()
+        t0 = time.perf_counter()
+        cancelled = False
+        try:
+            app.export_history(model, range(len(model)), path, app.HISTORY_HEADINGS, cancel)
+        except app.LoadCancelled:
+            cancelled = True
+        result["cancel"] = {
+            "cancelled": cancelled,
+            "stopped_after_s": round(time.perf_counter() - t0 - 0.5, 3),
+            "target_untouched": path.read_text("utf-8") == "previous export",
+            "leftovers": sorted(p.name for p in Path(tmp).iterdir() if p.suffix == ".part"),
+        }
+    _check(result,
+           all_rows_written=all(result[name]["rows"] == result[name]["view_rows"] for name in ("csv", "xlsx", "csv_filtered")),
+           cancel_stops_export=result["cancel"]["cancelled"],
+           cancel_keeps_target=result["cancel"]["target_untouched"],
+           cancel_cleans_up=not result["cancel"]["leftovers"])
+    return result
+
+
+def bench_memory(rows: int = 500_000) -> dict[str, Any]:
+    payload = json.dumps(_history_records(rows))
+    result: dict[str, Any] = {"rows": rows}
+    tracemalloc.start()
+    records = json.loads(payload)
+    numbers = {str(r.get("parcel_number") or "").strip() for r in records}
+    view = sorted(records, key=lambda x: app.parse_dt(x.get("scanned_at")), reverse=True)
+    result["list_of_dicts_mb"] = round(tracemalloc.get_traced_memory()[0] / 2**20, 1)
+    del records, numbers, view
+    tracemalloc.stop()
+    source = _history_rows(json.loads(payload))
+    tracemalloc.start()
+    store = app.HistoryStore.from_rows(source)
+    columns = tracemalloc.get_traced_memory()[0]
+    result["store_mb"] = round((columns - sys.getsizeof(store.search.blob) - sum(map(sys.getsizeof, store.search.user_rows))) / 2**20, 1)
+    result["store_with_search_mb"] = round(columns / 2**20, 1)
+    tracemalloc.stop()
+    return result
+
+
+def bench_ui(scans: int = 1000, burst: int = 10) -> dict[str, Any]:
+    """Tk time per scan for the recent-scans panel during a burst of scans."""
+    import tkinter as tk
+    from collections import deque
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as exc:
+        return {"skipped": str(exc)}
+    root.geometry("480x720")
+    result: dict[str, Any] = {"scans": scans, "burst": burst}
+    log: deque[list[str]] = deque(maxlen=12)
+
+    def rebuild(frame: tk.Frame) -> None:
+        for w in frame.winfo_children():
+            w.destroy()
+        for kind, ts, number, note in log:
+            row = tk.Frame(frame, bg=app.CARD_ALT); row.pack(fill="x", pady=3)
+            tk.Label(row, text=app.RecentScansPanel.ICONS.get(kind, "•"), bg=app.CARD_ALT, fg=app.RecentScansPanel.COLORS.get(kind, app.MUTED), font=("Segoe UI Emoji", 14)).pack(side="left", padx=(10, 8), pady=8)
+            col = tk.Frame(row, bg=app.CARD_ALT); col.pack(side="left", fill="x", expand=True, pady=6)
+            tk.Label(col, text=number, bg=app.CARD_ALT, fg=app.TEXT, font=("Segoe UI Semibold", 12, "bold"), anchor="w").pack(anchor="w", fill="x")
+            tk.Label(col, text=f"{ts} • {note}", bg=app.CARD_ALT, fg=app.MUTED, font=("Segoe UI", 10), anchor="w").pack(anchor="w", fill="x")
+
+    try:
+        for mode in ("rebuild", "recycled", "recycled_coalesced"):
+            log.clear()
+            holder = tk.Frame(root); holder.pack(fill="both", expand=True)
+            panel = app.RecentScansPanel(holder, 12) if mode != "rebuild" else None
+            root.update()
+            samples: list[float] = []
+            for i in range(scans):
+                number = str(80_000_000_000 + i)
+                t0 = time.perf_counter()
+                log.appendleft(["pending", datetime.now().strftime("%H:%M:%S"), number, "Надсилання..."])
+                if i >= 1:
+                    log[1][0], log[1][3] = "ok", "Збережено"
+                if panel is None:
+                    rebuild(holder)
+                elif mode == "recycled" or i % burst == burst - 1:
+                    panel.show(log)
+                if mode != "recycled_coalesced" or i % burst == burst - 1:
+                    root.update_idletasks()
+                samples.append((time.perf_counter() - t0) * 1000)
+            root.update()
+            holder.destroy()
+            samples.sort()
+            result[mode] = {
+                "mean_ms": round(statistics.fmean(samples), 3),
+                "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+                "total_ms": round(sum(samples), 1),
+            }
+    finally:
+        root.destroy()
+    return result
+
+
+SCENARIOS: dict[str, Callable[[], dict[str, Any]]] = {
+    "queue": bench_queue,
+    "sync": bench_sync,
+    "dupindex": bench_dupindex,
+    "search": bench_search,
+    "memory": bench_memory,
+    "history": bench_history,
+    "dispatch": bench_dispatch,
+    "pipeline": bench_pipeline,
+    "ui": bench_ui,
+    "transport": bench_transport,
+    "import": bench_import,
+    "load": bench_load,
+    "telemetry": bench_telemetry,
+    "startup": bench_startup,
+    "multiproc": bench_multiproc,
+    "link": bench_link,
+    "export": bench_export,
+}
+
+
+def _flatten(value: Any, prefix: str = "") -> dict[str, float]:
+    if isinstance(value, dict):
+        return {k: v for key, item in value.items() for k, v in _flatten(item, f"{prefix}{key}.").items()}
+    if isinstance(value, list):
+        return {k: v for i, item in enumerate(value) for k, v in _flatten(item, f"{prefix}{i}.").items()}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix.rstrip("."): float(value)}
+    return {}
+
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float = 0.1) -> list[str]:
+    """Lines for numeric results that moved by more than ``threshold`` (relative)."""
+    before, after = _flatten(old.get("results", old)), _flatten(new.get("results", new))
+    lines = []
+    for key in sorted(before.keys() & after.keys()):
+        a, b = before[key], after[key]
+        if a != b and abs(b - a) > threshold * max(abs(a), 1e-9):
+            lines.append(f"{key}: {a:g} -> {b:g} ({(b - a) / a * 100:+.0f}%)" if a else f"{key}: {a:g} -> {b:g}")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenarios", nargs="*", help=", ".join(SCENARIOS))
+    parser.add_argument("--json", metavar="PATH", help="save results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="report changes against an earlier --json file")
+    parser.add_argument("--scans", type=int, help="scans per run (scenarios that take it)")
+    parser.add_argument("--latency", type=float, help="stub latency in seconds")
+    parser.add_argument("--error-rate", dest="faults", type=float, help="share of stub requests that fail")
+    parser.add_argument("--history-rows", type=int, help="history size served by the stub, up to 1M")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+    overrides = {k: v for k, v in vars(args).items() if k in ("scans", "latency", "faults", "history_rows") and v is not None}
+    results: dict[str, Any] = {}
+    for name in args.scenarios or SCENARIOS:
+        fn = SCENARIOS[name]
+        results[name] = fn(**{k: v for k, v in overrides.items() if k in inspect.signature(fn).parameters})
+        print(name, results[name])
+    failed = [f"{name}.{check}" for name, result in results.items() for check, ok in result.get("checks", {}).items() if not ok]
+    report = {
+        "meta": {
+            "when": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "overrides": overrides,
+            "peak_rss_mb": _peak_rss_mb(),
+        },
+        "results": results,
+    }
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), "utf-8")
+    if args.compare:
+        for line in compare(json.loads(Path(args.compare).read_text("utf-8")), report) or ["no changes above 10%"]:
+            print(line)
+    if failed:
+        sys.exit("FAILED: " + ", ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,33 +6,89 @@
 
 Install: pip install requests
 Run:     python scanpak_windows.py
+Import:  python scanpak_windows.py --import scans.csv [--rate 100] [--workers 4]
+
+A --windowed build has no console: progress, the import summary and errors
+are appended to console.log in the app data folder instead.
 """
 from __future__ import annotations
 
+import argparse
+import bisect
+import csv
+import gzip
+import hashlib
 import json
+import math
 import os
 import queue
+import random
 import re
+import socket
 import sqlite3
+import sys
 import threading
+import time
 import tkinter as tk
+import traceback
+import uuid
+from array import array
 from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from itertools import chain, islice
 from pathlib import Path
-from tkinter import messagebox, ttk
-from typing import Any, Callable
+from tkinter import filedialog, messagebox, ttk
+from typing import Any, Callable, Iterable, Iterator, Sequence
+from urllib.parse import urlsplit
 
-import requests
+requests: Any = None  # imported by _load_requests() on first network use; it costs ~0.1 s at startup
 
 APP_NAME = "СканПак"
 API_BASE_URL = "https://tracking-app.dclink.ua"
 API_BASE_PATH = "/scanpak"
-TIMEOUT = 12
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 12.0
+HTTP_RETRIES = 2
+HTTP_RETRY_DELAY = 0.25
+GZIP_MIN_BYTES = 1024
+SYNC_BATCH = 200
+SYNC_WORKERS = 4
+SYNC_BACKOFF = 5.0
+SYNC_BACKOFF_MAX = 600.0
+SYNC_LEASE = 300.0
+SYNC_IDLE = 15.0
+LINK_BACKOFF = 1.0
+LINK_BACKOFF_MAX = 60.0
+PROBE_TIMEOUT = 2.0
+LINK_STRIKES = HTTP_RETRIES + 1
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.001
+SEARCH_DEBOUNCE_MS = 150
+SEARCH_INLINE_ROWS = 50_000
+HISTORY_PAGE = 5000
+HISTORY_MAX_PAGES = 2000
+HISTORY_VERIFY_INTERVAL = 24 * 3600
+HISTORY_CHUNK = 1000
+HISTORY_READ_SIZE = 64 * 1024
+TASK_LANES = {"scan": 4, "export": 1, "history": 2, "search": 1, "misc": 2}
+UI_HEARTBEAT_MS = 1000
+HTTP_POOL = sum(TASK_LANES.values()) + SYNC_WORKERS
+SCAN_BATCH = 50
+IMPORT_RATE = 100.0
+METRICS_INTERVAL_MS = 10_000
+METRICS_LAG_PROBE_MS = 250
+METRICS_MAX_BYTES = 1_000_000
+METRICS_BACKUPS = 3
+EXPORT_CHUNK = 5000
+HISTORY_HEADINGS = ["Дата і час", "Користувач", "Номер посилки"]
+XLSX_MAX_ROWS = 1_048_576
 
 APP_DIR = Path(os.getenv("APPDATA") or Path.home()) / "ScanPak_Windows"
-APP_DIR.mkdir(parents=True, exist_ok=True)
 DB_PATH = APP_DIR / "scanpak.sqlite3"
 CONFIG_PATH = APP_DIR / "session.json"
+METRICS_PATH = APP_DIR / "metrics.jsonl"
+CONSOLE_LOG_PATH = APP_DIR / "console.log"
 
 BG = "#0A1330"
 SIDEBAR = "#0E1A45"
@@ -72,46 +128,475 @@ def fmt_dt(value: Any) -> str:
     return str(value or "") if dt == datetime.min else dt.strftime("%d.%m.%Y %H:%M:%S")
 
 
+def to_epoch(value: Any) -> float:
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return 0.0
+
+
 class ApiError(Exception):
+    def __init__(self, message: str, status: int | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class LoadCancelled(Exception):
     pass
 
 
+def iter_json_array(pieces: Iterable[str], cancel: threading.Event | None = None) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    buf, pos, started = "", 0, False
+    for piece in pieces:
+        if cancel is not None and cancel.is_set():
+            raise LoadCancelled()
+        buf, pos = buf[pos:] + piece, 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("expected a JSON array")
+                started, pos = True, pos + 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                break
+            if isinstance(item, (int, float)) and not buf[end:].strip("0123456789.eE+-"):
+                break  # the number may continue in the next piece
+            pos = end
+            yield item
+    raise ValueError("truncated JSON array")
+
+
+class Histogram:
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1; self.total += ms; self.max = max(self.max, ms)
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        for bound, seen in zip(self.BOUNDS, self.counts):
+            rank -= seen
+            if rank <= 0:
+                return min(float(bound), self.max)
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count, "mean_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.quantile(0.5), 2), "p95_ms": round(self.quantile(0.95), 2), "max_ms": round(self.max, 2), "buckets": list(self.counts),
+        }
+
+
+class Telemetry:
+    """Opt-in process metrics: latency histograms, counters and periodic samples.
+
+    Call sites check ``enabled`` before measuring anything, so a disabled
+    instance costs one attribute lookup per hook. Samples are appended as JSON
+    lines to a size-rotated file.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self.samples: deque[dict[str, Any]] = deque(maxlen=360)
+        self._lock = threading.Lock()
+        self._path: Path | None = None
+        self._file: Any = None
+        self._last = (time.monotonic(), 0)
+
+    def enable(self, path: Path | None = METRICS_PATH) -> None:
+        self._path = path; self.enabled = True
+
+    def close(self) -> None:
+        self.enabled = False
+        if self._file is not None:
+            self._file.close(); self._file = None
+
+    def observe(self, name: str, ms: float) -> None:
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = Histogram()
+            hist.add(ms)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def http(self, sample: dict[str, Any]) -> None:
+        self.observe(f"http {sample['method']} {sample['endpoint']}", sample["total_ms"])
+        if sample["status"] is None or sample["status"] >= 500:
+            self.count(f"http errors {sample['endpoint']}")
+
+    def sample(self, **gauges: Any) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            sent = self.counters.get("sync sent", 0); since, before = self._last; self._last = (now, sent)
+            snap = {
+                "ts": datetime.now().isoformat(timespec="seconds"),
+                **gauges,
+                "sync_per_s": round((sent - before) / (now - since), 2) if now > since else 0.0,
+                "counters": dict(self.counters),
+            }
+        snap["latency"] = self.latency(); self.samples.append(snap)
+        return snap
+
+    def latency(self) -> dict[str, dict[str, Any]]:
+        with self._lock:
+            return {name: hist.summary() for name, hist in self.histograms.items()}
+
+    def write(self, snap: dict[str, Any]) -> None:
+        if self._path is None:
+            return
+        import logging.handlers
+        if self._file is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = logging.handlers.RotatingFileHandler(self._path, maxBytes=METRICS_MAX_BYTES, backupCount=METRICS_BACKUPS, encoding="utf-8")
+        self._file.handle(logging.makeLogRecord({"msg": json.dumps(snap, ensure_ascii=False, separators=(",", ":"))}))
+
+
+metrics = Telemetry()
+
+
+_wire = threading.local()
+
+
+class _TimedConnection:
+    """Records DNS and connect (incl. TLS) time of new connections for the calling thread.
+
+    The DNS figure needs a lookup of its own (usually answered from the OS
+    cache), so it is only taken while a Transport has hooks to report it to.
+    """
+
+    def _new_conn(self) -> Any:
+        if getattr(_wire, "timed", False):
+            t0 = time.perf_counter()
+            try:
+                socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)  # type: ignore[attr-defined]
+            except OSError:
+                pass  # urllib3 repeats the lookup below and reports the failure as NameResolutionError, as without hooks
+            _wire.dns = time.perf_counter() - t0
+        return super()._new_conn()  # type: ignore[misc]
+
+    def connect(self) -> None:
+        t0 = time.perf_counter()
+        super().connect()  # type: ignore[misc]
+        _wire.connect = time.perf_counter() - t0 - getattr(_wire, "dns", 0.0)
+
+
+_net_lock = threading.Lock()
+_timed_adapter: Any = None
+_connect_failure: Any = None  # urllib3's ConnectTimeoutError, also the base of NewConnectionError (refused, no route, DNS)
+
+
+def _load_requests() -> Any:
+    """Import requests and build the timing adapter once, from whichever thread needs it first."""
+    global requests, _timed_adapter, _connect_failure
+    with _net_lock:
+        if _timed_adapter is None:
+            import requests as module
+            from requests.adapters import HTTPAdapter
+            from urllib3.connection import HTTPConnection, HTTPSConnection
+            from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+            from urllib3.exceptions import ConnectTimeoutError
+
+            class TimedHTTPPool(HTTPConnectionPool):
+                ConnectionCls = type("TimedHTTPConnection", (_TimedConnection, HTTPConnection), {})
+
+            class TimedHTTPSPool(HTTPSConnectionPool):
+                ConnectionCls = type("TimedHTTPSConnection", (_TimedConnection, HTTPSConnection), {})
+
+            class TimedAdapter(HTTPAdapter):
+                def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+                    super().init_poolmanager(*args, **kwargs)
+                    self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPPool, "https": TimedHTTPSPool}
+
+            requests, _timed_adapter, _connect_failure = module, TimedAdapter, ConnectTimeoutError
+    return requests
+
+
+class Transport:
+    """Pooled HTTP session: split timeouts, gzip bodies, safe retries and per-request timings.
+
+    Hooks receive one dict per attempt with endpoint, method, status (None on a
+    network error), attempt, dns_ms, connect_ms (0 on a reused connection),
+    ttfb_ms and total_ms. For streamed responses total_ms stops at the headers.
+    """
+
+    IDEMPOTENT = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+    RETRY_STATUS = frozenset({429, 502, 503, 504})
+    GZIP_REJECTED = frozenset({400, 415, 422})
+
+    def __init__(
+        self,
+        pool_size: int = HTTP_POOL,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        retry_delay: float = HTTP_RETRY_DELAY,
+        gzip_min: int = GZIP_MIN_BYTES,
+    ) -> None:
+        net = _load_requests()
+        self.retry_errors = (net.ConnectionError, net.Timeout, net.exceptions.ChunkedEncodingError)
+        self.session = net.Session()
+        adapter = _timed_adapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        self.session.headers.update({"Accept": "application/json", "Accept-Encoding": "gzip, deflate"})
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.gzip_min = gzip_min
+        self.hooks: list[Callable[[dict[str, Any]], None]] = []
+        self.link: LinkMonitor | None = None
+
+    def request(
+        self, method: str, url: str, *, endpoint: str = "", body: Any = None, headers: dict[str, str | None] | None = None, **kwargs: Any
+    ) -> requests.Response:
+        headers = dict(headers or {})
+        if body is not None:
+            data = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
+            headers["Content-Type"] = "application/json"
+            if self.gzip_min and len(data) >= self.gzip_min:
+                data = gzip.compress(data, 5); headers["Content-Encoding"] = "gzip"
+            kwargs["data"] = data
+        retry = method in self.IDEMPOTENT or bool(headers.get("Idempotency-Key"))
+        attempt = 0
+        plain_retry = False
+        while True:
+            _wire.dns = _wire.connect = 0.0; _wire.timed = bool(self.hooks); t0 = time.perf_counter(); ttfb = [0.0]
+            try:
+                r = self.session.request(
+                    method, url, headers=headers, timeout=self.timeout, hooks={"response": lambda *_a, **_kw: ttfb.__setitem__(0, time.perf_counter())}, **kwargs
+                )
+            except requests.RequestException as exc:
+                self._emit(endpoint, method, None, attempt, t0, ttfb[0])
+                if self.link is not None:
+                    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+                    self.link.failed(isinstance(exc, requests.ConnectTimeout) or isinstance(reason, _connect_failure))
+                if not retry or attempt >= self.retries or not isinstance(exc, self.retry_errors) or self.link is not None and self.link.down:
+                    raise
+                after = None
+            else:
+                self._emit(endpoint, method, r.status_code, attempt, t0, ttfb[0])
+                if self.link is not None:
+                    self.link.ok()
+                if r.status_code in self.GZIP_REJECTED and headers.get("Content-Encoding") == "gzip":
+                    # Many servers answer a body they cannot decode with 400/422 rather than 415: resend it plain.
+                    r.close(); plain_retry = True; del headers["Content-Encoding"]; kwargs["data"] = gzip.decompress(kwargs["data"]); continue
+                if plain_retry and r.status_code < 400:
+                    self.gzip_min = 0  # the plain copy went through, so gzip was the problem
+                if not retry or attempt >= self.retries or r.status_code not in self.RETRY_STATUS:
+                    return r
+                after = r.headers.get("Retry-After"); r.close()
+            attempt += 1
+            time.sleep(self._delay(attempt, after))
+
+    def _delay(self, attempt: int, retry_after: str | None) -> float:
+        after = (retry_after or "").strip()
+        if after.isascii() and after.isdigit():
+            return min(float(after), self.timeout[1])
+        return min(self.retry_delay * 2 ** (attempt - 1), self.timeout[1]) * random.uniform(0.5, 1.5)
+
+    def _emit(self, endpoint: str, method: str, status: int | None, attempt: int, t0: float, ttfb: float) -> None:
+        if not self.hooks:
+            return
+        sample = {
+            "endpoint": endpoint, "method": method, "status": status, "attempt": attempt,
+            "dns_ms": _wire.dns * 1000, "connect_ms": _wire.connect * 1000,
+            "ttfb_ms": (ttfb - t0) * 1000 if ttfb else None, "total_ms": (time.perf_counter() - t0) * 1000,
+        }
+        for hook in self.hooks:
+            try:
+                hook(sample)
+            except Exception:
+                traceback.print_exc()
+
+
+class LinkMonitor:
+    """Circuit breaker for the server link, fed by every HTTP attempt.
+
+    It opens after ``strikes`` failed attempts in a row with no HTTP status
+    (read timeouts included: a slow server is not a dead link), or at once when
+    no connection could be made, for an exponentially growing, jittered interval.
+    Once that has passed, allow() admits exactly one trial request; the rest
+    are refused until the trial ends. Any HTTP response closes it and calls
+    ``on_up`` if it was open.
+    """
+
+    def __init__(self, backoff: float = LINK_BACKOFF, backoff_max: float = LINK_BACKOFF_MAX, strikes: int = LINK_STRIKES) -> None:
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.strikes = strikes
+        self.failures = 0
+        self.retry_at = 0.0
+        self.on_up: list[Callable[[], None]] = []
+        self._misses = 0
+        self._trial: int | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def down(self) -> bool:
+        return self.failures > 0
+
+    def ready(self) -> bool:
+        """True while the link is up, or once the backoff has elapsed and no trial is out."""
+        return not self.failures or (self._trial is None and time.monotonic() >= self.retry_at)
+
+    def retry_in(self) -> float:
+        return max(0.05, self.retry_at - time.monotonic()) if self.failures else 0.0
+
+    def allow(self) -> bool:
+        """May this thread send a request now? While open, only the one trial may."""
+        if not self.failures:
+            return True
+        with self._lock:
+            if not self.failures:
+                return True
+            if self._trial is not None or time.monotonic() < self.retry_at:
+                return False
+            self._trial = threading.get_ident()
+            return True
+
+    def settle(self) -> None:
+        """End this thread's trial without a verdict (it never reached the network)."""
+        if self._trial == threading.get_ident():
+            with self._lock:
+                self._trial = None
+
+    def ok(self) -> None:
+        if not self.failures and not self._misses:
+            return
+        with self._lock:
+            was_down = self.failures > 0
+            self.failures = self._misses = 0; self.retry_at = 0.0; self._trial = None
+        if was_down:
+            for fn in self.on_up:
+                fn()
+
+    def failed(self, unreachable: bool = False) -> None:
+        with self._lock:
+            if self.failures:
+                if self._trial != threading.get_ident():
+                    return  # started before the breaker opened; only the trial's outcome counts
+                self._trial = None
+            else:
+                self._misses += 1
+                if not unreachable and self._misses < self.strikes:
+                    return
+            self.failures += 1
+            self.retry_at = time.monotonic() + min(self.backoff_max, self.backoff * 2 ** (self.failures - 1)) * random.uniform(0.5, 1.5)
+
+
+class LinkDown(ApiError):
+    """Refused locally: the breaker is open, so the request never went out."""
+
+    def __init__(self) -> None:
+        super().__init__("Немає зв'язку з сервером")
+
+
 class ApiClient:
-    def __init__(self, base_url: str = API_BASE_URL) -> None:
+    def __init__(self, base_url: str = API_BASE_URL, transport: Transport | None = None) -> None:
         self.base_url = base_url.rstrip("/")
-        self.session = requests.Session()
+        self.link = LinkMonitor()
+        self._http = transport
+        if transport is not None:
+            transport.link = self.link
+        self._http_lock = threading.Lock()
         self.token = ""
 
+    @property
+    def http(self) -> Transport:
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    http = Transport(); http.link = self.link
+                    if self._token: http.session.headers["Authorization"] = f"Bearer {self._token}"
+                    self._http = http  # publish only once the header is in place
+        return self._http
+
+    @property
+    def token(self) -> str:
+        return self._token
+
+    @token.setter
+    def token(self, value: str) -> None:
+        with self._http_lock:  # a transport being built reads the token under the same lock
+            self._token = value
+            if self._http is None:
+                return
+            if value:
+                self._http.session.headers["Authorization"] = f"Bearer {value}"
+            else:
+                self._http.session.headers.pop("Authorization", None)
+
     def _url(self, path: str) -> str:
         return f"{self.base_url}{API_BASE_PATH}{path}"
 
-    def _headers(self, auth: bool = True) -> dict[str, str]:
-        headers = {"Accept": "application/json", "Content-Type": "application/json"}
-        if auth and self.token:
-            headers["Authorization"] = f"Bearer {self.token}"
-        return headers
-
-    def _request(self, method: str, path: str, *, auth: bool = True, **kwargs: Any) -> Any:
+    def _send(self, method: str, path: str, *, auth: bool = True, headers: dict[str, str] | None = None, **kwargs: Any) -> requests.Response:
+        extra: dict[str, str | None] = {**(headers or {})}
+        if not auth:
+            extra["Authorization"] = None
+        if not self.link.allow():
+            raise LinkDown()
         try:
-            r = self.session.request(method, self._url(path), headers=self._headers(auth), timeout=TIMEOUT, **kwargs)
+            r = self.http.request(method, self._url(path), endpoint=path, headers=extra, **kwargs)
         except requests.RequestException as exc:
             raise ApiError("Немає зв'язку з сервером") from exc
-        if r.status_code < 200 or r.status_code >= 300:
+        finally:
+            self.link.settle()
+        if (r.status_code < 200 or r.status_code >= 300) and r.status_code != 304:
             try:
                 body = r.json()
                 msg = body.get("detail") or body.get("message") or r.text
             except Exception:
                 msg = r.text
-            raise ApiError(msg or f"Помилка сервера ({r.status_code})")
-        if not r.text:
+            raise ApiError(msg or f"Помилка сервера ({r.status_code})", r.status_code)
+        return r
+
+    def probe(self, timeout: float = PROBE_TIMEOUT) -> bool:
+        """Cheap reachability check: a bare TCP connect to the API host, no request or auth."""
+        url = urlsplit(self.base_url)
+        if not self.link.allow():
+            return False
+        try:
+            socket.create_connection((url.hostname or "", url.port or (443 if url.scheme == "https" else 80)), timeout).close()
+        except OSError:
+            self.link.failed(True)
+            return False
+        self.link.settle()  # reachable; the next real request is the trial
+        return True
+
+    @staticmethod
+    def _json(r: requests.Response) -> Any:
+        if r.status_code == 304 or not r.text:
             return None
         try:
             return r.json()
         except ValueError as exc:
             raise ApiError("Некоректна відповідь сервера") from exc
 
+    def _request(self, method: str, path: str, **kwargs: Any) -> Any:
+        return self._json(self._send(method, path, **kwargs))
+
     def login(self, surname: str, password: str) -> dict[str, Any]:
-        data = self._request("POST", "/login", auth=False, data=json.dumps({"surname": surname, "password": password}))
+        data = self._request("POST", "/login", auth=False, body={"surname": surname, "password": password})
         token = str(data.get("token") or "")
         if not token:
             raise ApiError("Сервер не повернув токен")
@@ -119,52 +604,1113 @@ class ApiClient:
         return data
 
     def register(self, surname: str, password: str) -> None:
-        self._request("POST", "/register", auth=False, data=json.dumps({"surname": surname, "password": password}))
+        self._request("POST", "/register", auth=False, body={"surname": surname, "password": password})
+
+    def add_scan(self, parcel_number: str, idempotency_key: str | None = None) -> dict[str, Any]:
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        return self._request("POST", "/scans", headers=headers, body={"parcel_number": parcel_number}) or {}
 
-    def add_scan(self, parcel_number: str) -> dict[str, Any]:
-        return self._request("POST", "/scans", data=json.dumps({"parcel_number": parcel_number})) or {}
+    def add_scans(self, items: list[tuple[str, str]]) -> list[dict[str, Any]]:
+        payload = {"scans": [{"parcel_number": number, "idempotency_key": key} for number, key in items]}
+        data = self._request("POST", "/scans/batch", body=payload)
+        if not isinstance(data, list) or len(data) != len(items):
+            raise ApiError("Некоректна відповідь сервера")
+        return data
 
     def get_history(self) -> list[dict[str, Any]]:
         return self._request("GET", "/history") or []
 
+    def stream_history(
+        self, since: str = "", etag: str = "", last_modified: str = "", cancel: threading.Event | None = None,
+        complete: list[bool] | None = None,
+    ) -> tuple[Iterator[list[dict[str, Any]]] | None, str, str]:
+        """Chunks of /history rows; once they run out, ``complete`` gets True if every row is known to have been seen."""
+        headers = {k: v for k, v in (("If-None-Match", etag), ("If-Modified-Since", last_modified)) if v}
+        params: dict[str, Any] = {"limit": HISTORY_PAGE, "offset": 0}
+        if since:
+            params["since"] = since
+        r = self._send("GET", "/history", headers=headers, params=params, stream=True)
+        if r.status_code == 304:
+            r.close()
+            return None, etag, last_modified
+        chunks = self._history_chunks(r, params, cancel, complete)
+        return chunks, r.headers.get("ETag", ""), r.headers.get("Last-Modified", "")
+
+    def _history_chunks(
+        self, r: requests.Response, params: dict[str, Any], cancel: threading.Event | None, complete: list[bool] | None = None
+    ) -> Iterator[list[dict[str, Any]]]:
+        # An envelope's `next` or `total` decides whether more pages follow, since servers may cap a page below
+        # `limit`. Without one, a page is the last unless it holds exactly `limit` rows: a longer one means the
+        # server ignored the limit. A server that ignores the offset is caught when a page repeats the previous
+        # page's first row, wherever it sits in the page, since new rows may have been added to a newest-first list.
+        # The load counts as complete only if it ended on the server's word, with any `total` matching what was read.
+        prev_first: Any = None
+        for page in range(1, HISTORY_MAX_PAGES + 1):
+            repeated, more, total = False, None, None
+            try:
+                r.encoding = r.encoding or "utf-8"
+                pieces = r.iter_content(HISTORY_READ_SIZE, decode_unicode=True)
+                head = ""
+                for piece in pieces:
+                    head += piece
+                    if head.strip():
+                        break
+                if head.lstrip().startswith("["):
+                    items: Iterable[Any] = iter_json_array(chain((head,), pieces), cancel)
+                else:
+                    body = json.loads(head + "".join(pieces)) if head.strip() else {"items": []}
+                    items = body.get("items") if isinstance(body, dict) else None
+                    if not isinstance(items, list):
+                        raise ApiError("Некоректна відповідь сервера")
+                    if isinstance(body.get("total"), int):
+                        total = body["total"]
+                    if "next" in body:
+                        more = bool(body["next"])
+                    elif total is not None:
+                        more = params["offset"] + len(items) < total
+                batch: list[dict[str, Any]] = []
+                count = 0
+                for item in items:
+                    if not count:
+                        first = item
+                    if prev_first is not None and item == prev_first:
+                        repeated = True
+                        break
+                    count += 1
+                    if isinstance(item, dict):
+                        batch.append(item)
+                    if len(batch) >= HISTORY_CHUNK:
+                        yield batch
+                        batch = []
+                if batch:
+                    yield batch
+                if repeated or not count or (not more if more is not None else count != params["limit"]):
+                    if complete is not None and not repeated and not more and total in (None, params["offset"] + count):
+                        complete.append(True)
+                    return
+                prev_first = first
+            except requests.RequestException as exc:
+                raise ApiError("Немає зв'язку з сервером") from exc
+            except ValueError as exc:
+                raise ApiError("Некоректна відповідь сервера") from exc
+            finally:
+                r.close()
+            if cancel is not None and cancel.is_set():
+                raise LoadCancelled()
+            if page == HISTORY_MAX_PAGES:
+                return
+            params["offset"] += count
+            r = self._send("GET", "/history", params=params, stream=True)
+
+
+class SqliteStore:
+    """Thread-local SQLite connections; the file and schema are touched on first use, not construction."""
 
-class OfflineQueue:
     def __init__(self, db_path: Path) -> None:
         self.db_path = db_path
-        self._init()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._setup_lock = threading.Lock()
+        self._ready = False
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        if not self._ready:
+            with self._setup_lock:
+                if not self._ready:
+                    self._setup(db); self._ready = True
+        return db
+
+    def _setup(self, db: sqlite3.Connection) -> None:
+        pass
+
+    def open(self) -> None:
+        self._db()
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE, bits: bytes | None = None) -> None:
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class DuplicateIndex(SqliteStore):
+    """Every parcel number already scanned, in SQLite behind an in-memory Bloom filter.
+
+    The filter covers rows up to ``_bloom_id``; ids only grow (AUTOINCREMENT), so
+    when PRAGMA data_version says another connection committed, rows past that
+    watermark are added before a negative answer is trusted.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        super().__init__(db_path)
+        self._inflight: set[str] = set()
+        self._bloom: BloomFilter | None = None
+        self._bloom_id = 0
+
+    def _setup(self, db: sqlite3.Connection) -> None:
+        with db:
+            db.execute("BEGIN IMMEDIATE")  # another process may be migrating the same file
+            sql = db.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='known_numbers'").fetchone()
+            fresh = sql is None
+            legacy = not fresh and "AUTOINCREMENT" not in sql[0].upper()
+            if legacy:
+                # plain rowids can be reused once the highest ones are discarded, which a watermark would skip
+                db.execute("ALTER TABLE known_numbers RENAME TO known_numbers_old")
+            db.execute("CREATE TABLE IF NOT EXISTS known_numbers(id INTEGER PRIMARY KEY AUTOINCREMENT, parcel_number TEXT UNIQUE)")
+            db.execute("CREATE TABLE IF NOT EXISTS known_meta(name TEXT PRIMARY KEY, value BLOB)")
+            if legacy:
+                db.execute("INSERT INTO known_numbers SELECT id,parcel_number FROM known_numbers_old")
+                db.execute("DROP TABLE known_numbers_old")
+                db.execute("DELETE FROM known_meta WHERE name LIKE 'bloom%'")
+            if fresh:
+                self._seed(db)
+
+    @staticmethod
+    def _seed(db: sqlite3.Connection) -> None:
+        for table in ("history", "pending_scans"):
+            if db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone():
+                db.execute(f"INSERT OR IGNORE INTO known_numbers(parcel_number) SELECT parcel_number FROM {table} WHERE parcel_number<>''")
+
+    def reset(self) -> None:
+        """Rebuild from the history mirror and pending scans alone, e.g. once the mirror was wiped for another account."""
+        db = self._db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM known_numbers")
+            self._seed(db)
+            db.execute("DELETE FROM known_meta WHERE name LIKE 'bloom%'")
+        if self._bloom is not None:
+            self.warm()  # the old filter would only cost SQLite lookups, but it would never shrink
+
+    def warm(self) -> None:
+        db = self._db()
+        meta = dict(db.execute("SELECT name,value FROM known_meta").fetchall())
+        total, last_id = db.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM known_numbers").fetchone()
+        capacity = max(BLOOM_CAPACITY, 1 << max(0, 2 * total - 1).bit_length())
+        if meta.get("bloom") is not None and int(meta.get("bloom_capacity") or 0) >= total:
+            bloom, start = BloomFilter(int(meta["bloom_capacity"]), bits=meta["bloom"]), int(meta.get("bloom_id") or 0)
+        else:
+            bloom, start = BloomFilter(capacity), 0
+        for (number,) in db.execute("SELECT parcel_number FROM known_numbers WHERE id>? AND id<=?", (start, last_id)):
+            bloom.add(number)
+        with self._lock:
+            for row_id, number in db.execute("SELECT id,parcel_number FROM known_numbers WHERE id>? ORDER BY id", (last_id,)):
+                bloom.add(number); last_id = row_id
+            self._bloom, self._bloom_id = bloom, last_id
+        if last_id - start > 1000:
+            self.save()
+
+    def _catch_up(self) -> bool:
+        """Add rows other connections committed since the filter last looked; True if there were any."""
+        db = self._db(); local = self._local
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version == getattr(local, "version", None):
+            return False
+        local.version = version
+        with self._lock:
+            if self._bloom is None:
+                return False
+            rows = db.execute("SELECT id,parcel_number FROM known_numbers WHERE id>? ORDER BY id", (self._bloom_id,)).fetchall()
+            for row_id, number in rows:
+                self._bloom.add(number); self._bloom_id = row_id
+        return bool(rows)
+
+    def save(self) -> None:
+        bloom = self._bloom
+        if bloom is None:
+            return
+        db = self._db()
+        with self._lock:
+            bits, last_id = bytes(bloom.bits), self._bloom_id
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO known_meta VALUES(?,?)",
+                [("bloom", bits), ("bloom_capacity", bloom.capacity), ("bloom_id", last_id)],
+            )
 
-    def _init(self) -> None:
-        with sqlite3.connect(self.db_path) as db:
+    def add_many(self, numbers: Any) -> None:
+        numbers = [n for n in numbers if n]
+        if not numbers:
+            return
+        db = self._db()
+        with db:
+            db.executemany("INSERT OR IGNORE INTO known_numbers(parcel_number) VALUES(?)", ((n,) for n in numbers))
+        with self._lock:
+            if self._bloom is not None:
+                for n in numbers:
+                    self._bloom.add(n)
+
+    def add(self, number: str) -> None:
+        self.add_many((number,))
+
+    def discard(self, numbers: list[str]) -> None:
+        """Forget numbers the server deleted, unless the offline queue still holds them.
+
+        Their Bloom bits stay set; the filter only rules numbers out, so lookups fall through to SQLite.
+        """
+        db = self._db()
+        with db:
+            if db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='pending_scans'").fetchone():
+                sql = "DELETE FROM known_numbers WHERE parcel_number=? AND NOT EXISTS (SELECT 1 FROM pending_scans WHERE parcel_number=?)"
+                db.executemany(sql, ((n, n) for n in numbers))
+            else:
+                db.executemany("DELETE FROM known_numbers WHERE parcel_number=?", ((n,) for n in numbers))
+
+    def contains(self, number: str) -> bool:
+        with self._lock:
+            if number in self._inflight:
+                return True
+            bloom = self._bloom
+        if bloom is not None and number not in bloom and not (self._catch_up() and number in bloom):
+            return False
+        return self._db().execute("SELECT 1 FROM known_numbers WHERE parcel_number=?", (number,)).fetchone() is not None
+
+    def begin(self, number: str) -> bool:
+        if self.contains(number):
+            return False
+        with self._lock:
+            if number in self._inflight:
+                return False
+            self._inflight.add(number)
+        return True
+
+    def finish(self, number: str, stored: bool) -> None:
+        if stored:
+            self.add(number)
+        with self._lock:
+            self._inflight.discard(number)
+
+
+class OfflineQueue(SqliteStore):
+    """Pending scans shared by every process using the same database file.
+
+    Senders claim rows under a lease (owner + expiry) and delete them only
+    while still holding it, so concurrent syncs never send the same row twice;
+    rows of a crashed holder become claimable again once its lease expires.
+    The size is kept by triggers and re-read only when PRAGMA data_version
+    says another connection committed.
+    """
+
+    def __init__(self, db_path: Path, index: DuplicateIndex | None = None, lease: float = SYNC_LEASE) -> None:
+        super().__init__(db_path)
+        self.index = index
+        self.lease = lease
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.sync_lock = threading.Lock()
+
+    def _setup(self, db: sqlite3.Connection) -> None:
+        with db:
+            db.execute("BEGIN IMMEDIATE")  # another process may be migrating the same file
             db.execute(
                 "CREATE TABLE IF NOT EXISTS pending_scans("
                 "id INTEGER PRIMARY KEY AUTOINCREMENT, parcel_number TEXT, created_at TEXT)"
             )
-
-    def add(self, parcel_number: str) -> None:
-        with sqlite3.connect(self.db_path) as db:
-            db.execute("INSERT INTO pending_scans(parcel_number, created_at) VALUES(?,?)", (parcel_number, datetime.now().isoformat()))
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='pending_scans_number'").fetchone():
+                db.execute("DELETE FROM pending_scans WHERE id NOT IN (SELECT MIN(id) FROM pending_scans GROUP BY parcel_number)")
+                db.execute("CREATE UNIQUE INDEX pending_scans_number ON pending_scans(parcel_number)")
+            cols = {row[1] for row in db.execute("PRAGMA table_info(pending_scans)")}
+            for col, decl in (
+                ("idem_key", "TEXT"), ("attempts", "INTEGER NOT NULL DEFAULT 0"), ("next_attempt", "REAL NOT NULL DEFAULT 0"),
+                ("lease_owner", "TEXT"), ("lease_until", "REAL NOT NULL DEFAULT 0"),
+            ):
+                if col not in cols:
+                    db.execute(f"ALTER TABLE pending_scans ADD COLUMN {col} {decl}")
+            db.execute("UPDATE pending_scans SET idem_key=lower(hex(randomblob(16))) WHERE idem_key IS NULL")
+            db.execute("CREATE TABLE IF NOT EXISTS pending_meta(name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            if not db.execute("SELECT 1 FROM sqlite_master WHERE type='trigger' AND name='pending_scans_added'").fetchone():
+                db.execute("INSERT OR REPLACE INTO pending_meta(name, value) SELECT 'count', COUNT(*) FROM pending_scans")
+                db.execute("CREATE TRIGGER pending_scans_added AFTER INSERT ON pending_scans BEGIN UPDATE pending_meta SET value=value+1 WHERE name='count'; END")
+                db.execute("CREATE TRIGGER pending_scans_removed AFTER DELETE ON pending_scans BEGIN UPDATE pending_meta SET value=value-1 WHERE name='count'; END")
+
+    def _changed(self) -> None:
+        self._local.version = None  # this connection's own commits do not move its data_version
+
+    def add(self, parcel_number: str, idem_key: str | None = None) -> bool:
+        db = self._db()
+        with db:
+            cur = db.execute(
+                "INSERT OR IGNORE INTO pending_scans(parcel_number, created_at, idem_key) VALUES(?,?,?)",
+                (parcel_number, datetime.now().isoformat(), idem_key or uuid.uuid4().hex),
+            )
+        if self.index is not None:
+            self.index.add(parcel_number)
+        self._changed()
+        return cur.rowcount > 0
 
     def contains(self, parcel_number: str) -> bool:
-        with sqlite3.connect(self.db_path) as db:
-            row = db.execute("SELECT 1 FROM pending_scans WHERE parcel_number=? LIMIT 1", (parcel_number,)).fetchone()
-        return row is not None
+        return self._db().execute("SELECT 1 FROM pending_scans WHERE parcel_number=? LIMIT 1", (parcel_number,)).fetchone() is not None
 
     def count(self) -> int:
-        with sqlite3.connect(self.db_path) as db:
-            return int(db.execute("SELECT COUNT(*) FROM pending_scans").fetchone()[0])
+        db = self._db(); local = self._local
+        version = db.execute("PRAGMA data_version").fetchone()[0]
+        if version != getattr(local, "version", None):
+            local.version = version; local.count = int(db.execute("SELECT value FROM pending_meta WHERE name='count'").fetchone()[0])
+        return local.count
+
+    def claim(self, limit: int) -> list[tuple[int, str, str, int]]:
+        """Lease up to ``limit`` due rows that no live holder owns."""
+        db = self._db(); now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                "SELECT id,parcel_number,idem_key,attempts FROM pending_scans WHERE next_attempt<=? AND lease_until<=? ORDER BY id LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            db.executemany("UPDATE pending_scans SET lease_owner=?, lease_until=? WHERE id=?", [(self.owner, now + self.lease, r[0]) for r in rows])
+            db.commit()
+        except BaseException:
+            db.rollback(); raise
+        return rows
+
+    def remove(self, ids: list[int]) -> int:
+        if not ids:
+            return 0
+        db = self._db()
+        with db:
+            removed = db.executemany("DELETE FROM pending_scans WHERE id=? AND lease_owner=?", [(i, self.owner) for i in ids]).rowcount
+        ids.clear(); self._changed()
+        return removed
+
+    def release(self, ids: list[int]) -> None:
+        if not ids:
+            return
+        db = self._db()
+        with db:
+            db.executemany("UPDATE pending_scans SET lease_owner=NULL, lease_until=0 WHERE id=? AND lease_owner=?", [(i, self.owner) for i in ids])
+        ids.clear()
+
+    def defer(self, failed: list[tuple[int, int]]) -> None:
+        if not failed:
+            return
+        now = time.time()
+        rows = [(now + min(SYNC_BACKOFF_MAX, SYNC_BACKOFF * 2 ** attempts) * random.uniform(0.5, 1.5), row_id, self.owner) for row_id, attempts in failed]
+        db = self._db()
+        with db:
+            db.executemany(
+                "UPDATE pending_scans SET attempts=attempts+1, next_attempt=?, lease_owner=NULL, lease_until=0 WHERE id=? AND lease_owner=?", rows
+            )
+        failed.clear()
+
+    def sync(self, api: ApiClient, progress: Callable[[int, int], None] | None = None) -> int:
+        if not metrics.enabled:
+            return SyncEngine(self, api).drain(progress)
+        t0 = time.perf_counter(); sent = SyncEngine(self, api).drain(progress)
+        metrics.observe("sync drain", (time.perf_counter() - t0) * 1000); metrics.count("sync sent", sent)
+        return sent
+
+
+class SyncEngine:
+    def __init__(self, queue: OfflineQueue, api: ApiClient, workers: int = SYNC_WORKERS) -> None:
+        self.queue = queue
+        self.api = api
+        self.workers = workers
 
-    def sync(self, api: ApiClient) -> int:
+    def drain(self, progress: Callable[[int, int], None] | None = None) -> int:
+        if not self.queue.sync_lock.acquire(blocking=False):
+            return 0
+        try:
+            return self._drain(progress)
+        finally:
+            self.queue.sync_lock.release()
+
+    def _send(self, parcel_number: str, idem_key: str) -> None:
+        try:
+            self.api.add_scan(parcel_number, idem_key)
+        except ApiError as exc:
+            if exc.status != 409:
+                raise
+
+    def _drain(self, progress: Callable[[int, int], None] | None) -> int:
+        total = self.queue.count()
         sent = 0
-        with sqlite3.connect(self.db_path) as db:
-            rows = db.execute("SELECT id,parcel_number FROM pending_scans ORDER BY id").fetchall()
-        for row_id, parcel_number in rows:
-            api.add_scan(parcel_number)
-            with sqlite3.connect(self.db_path) as db:
-                db.execute("DELETE FROM pending_scans WHERE id=?", (row_id,))
-            sent += 1
+        offline = 0
+        done: list[int] = []
+        failed: list[tuple[int, int]] = []
+        claimed: deque[tuple[int, str, str, int]] = deque()
+        exhausted = False
+        flushed = time.monotonic()
+        running: dict[Future[None], tuple[int, str, str, int]] = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sync") as pool:
+            try:
+                while True:
+                    while offline < self.workers and self.api.link.ready() and len(running) < self.workers * 2:
+                        if not claimed and not exhausted:
+                            claimed.extend(self.queue.claim(self.workers * 2 - len(running))); exhausted = not claimed
+                        if not claimed:
+                            break
+                        row = claimed.popleft()
+                        running[pool.submit(self._send, row[1], row[2])] = row
+                    if not running:
+                        break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        row = running.pop(fut); row_id, attempts = row[0], row[3]
+                        err = fut.exception()
+                        if isinstance(err, LinkDown):
+                            claimed.appendleft(row)  # never sent: no attempt to count
+                        elif err is None:
+                            done.append(row_id)
+                            sent += 1
+                            offline = 0
+                        else:
+                            failed.append((row_id, attempts))
+                            offline = offline + 1 if getattr(err, "status", None) is None else 0
+                    if len(done) >= SYNC_BATCH or done and time.monotonic() - flushed > min(1.0, self.queue.lease / 4):
+                        self.queue.remove(done); flushed = time.monotonic()
+                    if progress:
+                        progress(sent, total)
+            finally:
+                self.queue.remove(done)
+                self.queue.defer(failed)
+                self.queue.release([row[0] for row in claimed])  # rows still running keep their lease
         return sent
 
 
+class SyncScheduler:
+    """Background thread that drains the offline queue when there is something to send.
+
+    ``kick()`` wakes it at once (a scan was queued, the user logged in, the
+    link came back). While the link is down it waits out the breaker's
+    backoff and asks ``api.probe()`` before starting a drain; otherwise it
+    re-checks every ``idle`` seconds for rows whose retry time has come.
+    """
+
+    def __init__(
+        self,
+        queue: OfflineQueue,
+        api: ApiClient,
+        on_done: Callable[[int, Exception | None], None] | None = None,
+        progress: Callable[[], Callable[[int, int], None] | None] | None = None,
+        idle: float = SYNC_IDLE,
+    ) -> None:
+        self.queue = queue
+        self.api = api
+        self.on_done = on_done
+        self.progress = progress
+        self.idle = idle
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        api.link.on_up.append(self.kick)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sync-scheduler", daemon=True); self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set(); self._wake.set()
+
+    def kick(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        delay = 0.0
+        while not self._stop.is_set():
+            self._wake.wait(delay); self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                delay = self.step()
+            except Exception:
+                traceback.print_exc(); delay = self.idle
+
+    def step(self) -> float:
+        """One scheduling decision; returns how long to sleep unless kicked."""
+        link = self.api.link
+        if not self.api.token or not self.queue.count():
+            return self.idle
+        if not link.ready():
+            return link.retry_in()
+        if link.down and not self.api.probe():
+            return link.retry_in()
+        sent, err = 0, None
+        try:
+            sent = self.queue.sync(self.api, self.progress() if self.progress else None)
+        except Exception as exc:
+            err = exc
+        if self.on_done is not None:
+            self.on_done(sent, err)
+        return link.retry_in() if link.down else self.idle
+
+
+class HistoryMirror(SqliteStore):
+    def __init__(self, db_path: Path, index: DuplicateIndex | None = None) -> None:
+        super().__init__(db_path)
+        self.index = index
+        self._refresh_lock = threading.Lock()
+
+    def _setup(self, db: sqlite3.Connection) -> None:
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS history("
+                "key TEXT PRIMARY KEY, parcel_number TEXT, username TEXT, scanned_at TEXT, ts REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS history_ts ON history(ts)")
+            db.execute("CREATE TABLE IF NOT EXISTS history_meta(name TEXT PRIMARY KEY, value TEXT)")
+
+    @staticmethod
+    def _row(r: dict[str, Any]) -> tuple[str, str, str, str, float]:
+        number = str(r.get("parcel_number") or "").strip(); user = str(r.get("username") or ""); scanned_at = str(r.get("scanned_at") or "")
+        key = str(r["id"]) if r.get("id") is not None else f"{scanned_at}|{number}|{user}"
+        return key, number, user, scanned_at, to_epoch(scanned_at)
+
+    def _meta(self) -> dict[str, str]:
+        return dict(self._db().execute("SELECT name,value FROM history_meta").fetchall())
+
+    def rows(self) -> Iterator[tuple[str, str, str, float]]:
+        return self._db().execute("SELECT parcel_number,username,scanned_at,ts FROM history ORDER BY ts DESC")
+
+    def clear(self) -> None:
+        with self._refresh_lock:
+            self._wipe()
+
+    def _wipe(self) -> None:
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM history")
+            db.execute("DELETE FROM history_meta")
+        if self.index is not None:
+            self.index.reset()  # the previous owner's numbers must not stay duplicates either
+
+    def refresh(
+        self, api: ApiClient, on_chunk: Callable[[int], None] | None = None, cancel: threading.Event | None = None,
+        full: bool = False, owner: str = "",
+    ) -> bool:
+        """Fetch rows after the cursor.
+
+        The whole history is refetched and diffed when ``full`` is set or the last such pass is
+        HISTORY_VERIFY_INTERVAL old, so rows deleted or back-dated on the server are caught; rows are only
+        deleted when the fetch is known to be complete. A different ``owner`` (API and account) wipes the mirror.
+        """
+        with self._refresh_lock:
+            meta = self._meta()
+            if meta.get("owner", "") != owner:
+                self._wipe(); meta = {}
+            full = full or time.time() - float(meta.get("verified_at") or 0) >= HISTORY_VERIFY_INTERVAL
+            cursor = "" if full else meta.get("cursor", "")
+            prefix = "" if cursor else "full_"  # validators of the plain request are kept apart from the cursor's
+            complete: list[bool] = []
+            chunks, etag, last_modified = api.stream_history(
+                cursor, meta.get(prefix + "etag", ""), meta.get(prefix + "last_modified", ""), cancel, complete
+            )
+            db = self._db()
+            if chunks is None:
+                if full:
+                    with db:
+                        db.execute("INSERT OR REPLACE INTO history_meta VALUES('verified_at',?)", (str(time.time()),))
+                return False
+            cursor_ts = to_epoch(cursor)
+            full = not cursor
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS history_keys(key TEXT PRIMARY KEY)")
+            with db:
+                db.execute("DELETE FROM history_keys")
+            changed = received = 0
+            for chunk in chunks:
+                rows = [self._row(r) for r in chunk]
+                full = full or any(ts < cursor_ts for *_r, ts in rows)
+                with db:
+                    db.executemany("INSERT OR IGNORE INTO history_keys VALUES(?)", ((r[0],) for r in rows))
+                    inserted = db.executemany("INSERT OR IGNORE INTO history VALUES(?,?,?,?,?)", rows).rowcount
+                if self.index is not None and inserted:
+                    self.index.add_many(r[1] for r in rows)
+                changed += inserted
+                received += len(rows)
+                if on_chunk is not None:
+                    on_chunk(received)
+            gone: list[str] = []
+            with db:
+                if full and complete:
+                    gone = [n for (n,) in db.execute(
+                        "SELECT DISTINCT parcel_number FROM history WHERE key NOT IN (SELECT key FROM history_keys) "
+                        "AND parcel_number NOT IN (SELECT parcel_number FROM history WHERE key IN (SELECT key FROM history_keys))"
+                    )]
+                    changed += db.execute("DELETE FROM history WHERE key NOT IN (SELECT key FROM history_keys)").rowcount
+                latest = db.execute("SELECT scanned_at FROM history ORDER BY ts DESC LIMIT 1").fetchone()
+                updates = [("owner", owner), ("cursor", latest[0] if latest else "")]
+                for key in ("",) if cursor else ("", "full_") if complete else ():
+                    updates += [(key + "etag", etag), (key + "last_modified", last_modified)]
+                if full:
+                    updates.append(("verified_at", str(time.time())))  # even if incomplete: retrying sooner would not help
+                db.executemany("INSERT OR REPLACE INTO history_meta VALUES(?,?)", updates)
+            if gone and self.index is not None:
+                self.index.discard(gone)
+            return changed > 0
+
+
+class HistoryStore:
+    def __init__(self) -> None:
+        self.ts = array("q")
+        self.uid = array("I")
+        self.num = array("Q")
+        self.width = array("B")
+        self.users: list[str] = []
+        self._user_ids: dict[str, int] = {}
+        self.raw_numbers: dict[int, str] = {}
+        self.raw_times: dict[int, str] = {}
+        self.order = array("I")
+        self._search: HistorySearch | None = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[str, str, str, float]]) -> HistoryStore:
+        store = cls()
+        for number, user, scanned_at, epoch in rows:
+            store._append(number, user, scanned_at, epoch)
+        store.order = array("I", sorted(range(len(store.ts)), key=store.ts.__getitem__, reverse=True))
+        store._search = HistorySearch(store)
+        return store
+
+    def _append(self, number: str, user: str, scanned_at: str, epoch: float) -> int:
+        row = len(self.ts)
+        self.ts.append(int(epoch * 1000))
+        if not epoch and scanned_at:
+            self.raw_times[row] = scanned_at
+        uid = self._user_ids.get(user)
+        if uid is None:
+            uid = self._user_ids[user] = len(self.users)
+            self.users.append(user)
+        self.uid.append(uid)
+        if number.isascii() and number.isdigit() and len(number) < 20 and int(number) < 1 << 64:
+            self.num.append(int(number)); self.width.append(len(number))
+        else:
+            self.num.append(0); self.width.append(0)
+            if number:
+                self.raw_numbers[row] = number
+        return row
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def number(self, row: int) -> str:
+        width = self.width[row]
+        return str(self.num[row]).zfill(width) if width else self.raw_numbers.get(row, "")
+
+    def scanned_at(self, row: int) -> str:
+        ts = self.ts[row]
+        return datetime.fromtimestamp(ts / 1000).strftime("%d.%m.%Y %H:%M:%S") if ts else self.raw_times.get(row, "")
+
+    def __getitem__(self, pos: int) -> tuple[str, str, str]:
+        row = self.order[pos]
+        return self.scanned_at(row), self.users[self.uid[row]], self.number(row)
+
+    @property
+    def search(self) -> HistorySearch:
+        if self._search is None:
+            self._search = HistorySearch(self)
+        return self._search
+
+    def plan(self, query: str) -> int:
+        return self._search.plan(query) if self._search is not None else len(self)
+
+    def filter(self, query: str) -> Sequence[int]:
+        return self.search.query(query)
+
+
+class HistorySearch:
+    def __init__(self, store: HistoryStore) -> None:
+        order = store.order
+        self.size = len(order)
+        self.users = [u.lower() for u in store.users]
+        self.uids = array("I", (store.uid[row] for row in order))
+        self.user_rows = [array("I") for _ in self.users]
+        for pos, uid in enumerate(self.uids):
+            self.user_rows[uid].append(pos)
+        self.width = max((len(store.number(row)) for row in order), default=0) + 1
+        self.blob = "".join(store.number(row).lower().ljust(self.width - 1) + "\n" for row in order)
+        self._lock = threading.Lock()
+        self._last: tuple[str, Sequence[int]] = ("", range(self.size))
+
+    def _number_rows(self, candidates: Sequence[int], token: str) -> list[int]:
+        blob, width = self.blob, self.width
+        if not isinstance(candidates, range):
+            return [i for i in candidates if token in blob[i * width:(i + 1) * width]]
+        hits: list[int] = []
+        pos = blob.find(token)
+        while pos >= 0:
+            row = pos // width
+            hits.append(row)
+            pos = blob.find(token, (row + 1) * width)
+        return hits
+
+    def _narrow(self, candidates: Sequence[int], token: str) -> Sequence[int]:
+        mask = bytearray(token in user for user in self.users)
+        if all(mask):
+            return candidates
+        if not any(mask):
+            return self._number_rows(candidates, token)
+        uids = self.uids
+        if isinstance(candidates, range):
+            numbers = [i for i in self._number_rows(candidates, token) if not mask[uids[i]]]
+            return sorted(chain(numbers, *(rows for uid, rows in enumerate(self.user_rows) if mask[uid])))
+        blob, width = self.blob, self.width
+        return [i for i in candidates if mask[uids[i]] or token in blob[i * width:(i + 1) * width]]
+
+    def plan(self, query: str) -> int:
+        q = " ".join((query or "").lower().split())
+        if not q:
+            return 0
+        with self._lock:
+            last_q, last = self._last
+        if last_q and q.startswith(last_q) and len(last) <= self.size // 8:
+            return len(last)
+        tokens = q.split()
+        if max(map(len, tokens)) < 3:
+            return self.size
+        return sum(len(rows) for user, rows in zip(self.users, self.user_rows) if any(t in user for t in tokens))
+
+    def query(self, query: str) -> Sequence[int]:
+        q = " ".join((query or "").lower().split())
+        result: Sequence[int] = range(self.size)
+        if q:
+            with self._lock:
+                last_q, last = self._last
+            if last_q and q.startswith(last_q) and len(last) <= self.size // 8:
+                result = last
+            for token in sorted(q.split(), key=len, reverse=True):
+                result = self._narrow(result, token)
+        with self._lock:
+            self._last = (q, result)
+        return result
+
+
+_XLSX_NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+_XLSX_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+_FORMULA_START = ("=", "+", "-", "@", "\t", "\r")  # spreadsheet apps evaluate these; usernames are self-registered
+
+
+def _write_xlsx(path: Path, headings: Sequence[str], chunks: Iterable[list[tuple[str, ...]]], total: int) -> None:
+    """Minimal streamed workbook: inline strings only, so no shared-string table is held in memory."""
+    import zipfile
+    from xml.sax.saxutils import escape
+
+    def cell(value: str) -> str:
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_XML_INVALID.sub("", value))}</t></is></c>'
+
+    per_sheet = XLSX_MAX_ROWS - 1
+    sheets = max(1, -(-total // per_sheet))
+    head = "<row>" + "".join(map(cell, headings)) + "</row>"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=5) as zf:
+        zf.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(
+                f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                for i in range(1, sheets + 1)
+            ) + "</Types>"
+        ))
+        zf.writestr("_rels/.rels", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_XLSX_REL}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ))
+        zf.writestr("xl/workbook.xml", (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><workbook {_XLSX_NS} xmlns:r="{_XLSX_REL}"><sheets>'
+            + "".join(f'<sheet name="{APP_NAME} {i}" sheetId="{i}" r:id="rId{i}"/>' for i in range(1, sheets + 1))
+            + "</sheets></workbook>"
+        ))
+        zf.writestr("xl/_rels/workbook.xml.rels", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(f'<Relationship Id="rId{i}" Type="{_XLSX_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, sheets + 1))
+            + "</Relationships>"
+        ))
+        rows = chain.from_iterable(chunks)
+        for i in range(1, sheets + 1):
+            with zf.open(f"xl/worksheets/sheet{i}.xml", "w", force_zip64=True) as fh:
+                fh.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet {_XLSX_NS}><cols><col min="1" max="{len(headings)}" width="28"/></cols><sheetData>{head}'.encode())
+                buf: list[str] = []
+                for row in islice(rows, per_sheet):
+                    buf.append("<row>" + "".join(map(cell, row)) + "</row>")
+                    if len(buf) >= EXPORT_CHUNK:
+                        fh.write("".join(buf).encode()); buf.clear()
+                fh.write(("".join(buf) + "</sheetData></worksheet>").encode())
+
+
+def export_history(
+    rows: Sequence[tuple[str, ...]],
+    view: Sequence[int],
+    path: str | Path,
+    headings: Sequence[str],
+    cancel: threading.Event | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    chunk: int = EXPORT_CHUNK,
+) -> int:
+    """Write ``rows[i] for i in view`` to CSV, or to a workbook for a .xlsx path.
+
+    Rows are formatted ``chunk`` at a time into a temporary file beside the
+    target, which replaces it only once complete, so memory stays flat and a
+    cancelled or failed export leaves any existing file untouched. ``cancel``
+    is checked between chunks and raises LoadCancelled.
+    """
+    path = Path(path); tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.part")
+    total = len(view)
+
+    def chunks() -> Iterator[list[tuple[str, ...]]]:
+        for start in range(0, total, chunk):
+            if cancel is not None and cancel.is_set():
+                raise LoadCancelled()
+            yield [rows[i] for i in view[start:start + chunk]]
+            if progress is not None:
+                progress(min(start + chunk, total), total)
+
+    try:
+        if path.suffix.lower() == ".xlsx":
+            _write_xlsx(tmp, headings, chunks(), total)
+        else:
+            with open(tmp, "w", encoding="utf-8-sig", errors="replace", newline="") as fh:
+                out = csv.writer(fh, delimiter=";"); out.writerow(headings)  # ';' and a BOM so Excel opens it as-is
+                for block in chunks():
+                    out.writerows([["'" + v if v.startswith(_FORMULA_START) else v for v in row] for row in block])
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return total
+
+
+class ScanPipeline:
+    def __init__(
+        self,
+        api: ApiClient,
+        index: DuplicateIndex,
+        offline: OfflineQueue,
+        submit: Callable[[Callable[[], None]], None],
+        batch_size: int = SCAN_BATCH,
+    ) -> None:
+        self.api = api
+        self.index = index
+        self.offline = offline
+        self.submit = submit
+        self.batch_size = batch_size
+        self.batch_supported: bool | None = None if batch_size > 1 else False
+        self._pending: deque[tuple[str, str, Callable[[dict[str, Any] | None, Exception | None], None]]] = deque()
+        self._lock = threading.Lock()
+
+    def accept(self, number: str, on_result: Callable[[dict[str, Any] | None, Exception | None], None]) -> bool:
+        if not self.index.begin(number):
+            return False
+        with self._lock:
+            self._pending.append((number, uuid.uuid4().hex, on_result))
+        self.submit(self._flush)
+        return True
+
+    def _flush(self) -> None:
+        with self._lock:
+            limit = self.batch_size if self.batch_supported is not False else 1
+            batch = [self._pending.popleft() for _ in range(min(limit, len(self._pending)))]
+        if not batch:
+            return
+        results: list[tuple[dict[str, Any] | None, Exception | None]] = []
+        try:
+            if len(batch) > 1:
+                try:
+                    replies = self.api.add_scans([(number, key) for number, key, _cb in batch])
+                    self.batch_supported = True
+                    for reply in replies:
+                        failed = not isinstance(reply, dict) or reply.get("error")
+                        results.append((None, ApiError(str(reply.get("error") if isinstance(reply, dict) else reply))) if failed else (reply, None))
+                except ApiError as exc:
+                    if exc.status in (404, 405):
+                        self.batch_supported = False
+                        with self._lock:
+                            self._pending.extendleft(reversed(batch))
+                        for _ in batch:
+                            self.submit(self._flush)
+                        return
+                    results = [(None, exc)] * len(batch)
+            else:
+                number, key, _cb = batch[0]
+                try:
+                    results.append((self.api.add_scan(number, key), None))
+                except ApiError as exc:
+                    results.append((None, exc))
+        except Exception as exc:
+            results = [(None, exc)] * len(batch)
+        for (number, key, on_result), (res, err) in zip(batch, results):
+            try:
+                if isinstance(err, ApiError):
+                    self.offline.add(number, key)
+            except Exception as exc:
+                err = exc  # neither sent nor queued
+            finally:
+                self.index.finish(number, err is None)
+                on_result(res, err)
+
+
+def bulk_import(
+    path: str,
+    api: ApiClient,
+    index: DuplicateIndex,
+    offline: OfflineQueue,
+    workers: int = TASK_LANES["scan"],
+    rate: float = IMPORT_RATE,
+    column: int | None = None,
+    progress: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    """Stream parcel numbers from a CSV/TXT file (or '-' for stdin) through a ScanPipeline.
+
+    Each row contributes the digits of ``column`` (0-based) or of the cell with
+    the most digits, so dates and counters next to the number are ignored. At most ``rate`` numbers per second are accepted and at
+    most ``workers * SCAN_BATCH`` are in flight; failures land in the offline queue.
+    """
+    stats: dict[str, Any] = {"rows": 0, "empty": 0, "duplicates": 0, "sent": 0, "offline": 0, "failed": 0, "interrupted": False}
+    lanes = TaskLanes({"scan": workers})
+    pipeline = ScanPipeline(api, index, offline, lambda fn: lanes.submit("scan", fn))
+    window = workers * pipeline.batch_size; slots = threading.BoundedSemaphore(window); lock = threading.Lock()
+
+    def done(_res: Any, err: Exception | None) -> None:
+        with lock:
+            stats["sent" if err is None else "offline" if isinstance(err, ApiError) else "failed"] += 1
+        slots.release()
+
+    def report() -> dict[str, Any]:
+        elapsed = time.perf_counter() - t0
+        with lock:
+            return {**stats, "elapsed_s": round(elapsed, 2), "per_s": round((stats["sent"] + stats["offline"] + stats["failed"]) / elapsed, 1) if elapsed else 0.0}
+
+    fh = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", errors="replace", newline="")
+    t0 = pace = last = time.perf_counter()
+    try:
+        first = fh.readline(); delimiter = max(",;\t", key=first.count)
+        for row in csv.reader(chain((first,), fh), delimiter=delimiter):
+            stats["rows"] += 1
+            number = max(map(only_digits, row if column is None else row[column:column + 1]), key=len, default="")
+            if not number:
+                stats["empty"] += 1; continue
+            now = time.perf_counter()
+            if rate > 0:
+                pace = max(pace + 1 / rate, now - 1)
+                if pace > now:
+                    time.sleep(pace - now)
+            slots.acquire()  # only after the pacing sleep, where Ctrl-C usually lands
+            try:
+                accepted = pipeline.accept(number, done)
+            except BaseException:
+                slots.release(); raise  # done() will never run for it
+            if not accepted:
+                stats["duplicates"] += 1; slots.release(); continue
+            if progress is not None and now - last >= 2:
+                last = now; progress(report())
+    except KeyboardInterrupt:
+        stats["interrupted"] = True
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+        for _ in range(window):
+            slots.acquire()
+    index.save()
+    return report()
+
+
+class TaskLanes:
+    def __init__(self, sizes: dict[str, int]) -> None:
+        self._queues: dict[str, queue.SimpleQueue[Callable[[], None]]] = {lane: queue.SimpleQueue() for lane in sizes}
+        self._lock = threading.Lock()
+        self._stats = {lane: {"workers": size, "queued": 0, "running": 0, "done": 0, "peak": 0} for lane, size in sizes.items()}
+        for lane, size in sizes.items():
+            for i in range(size):
+                threading.Thread(target=self._worker, args=(lane,), name=f"{lane}-{i}", daemon=True).start()
+
+    def submit(self, lane: str, fn: Callable[[], None]) -> None:
+        with self._lock:
+            stats = self._stats[lane]
+            stats["queued"] += 1
+            stats["peak"] = max(stats["peak"], stats["queued"] + stats["running"])
+        if metrics.enabled:
+            fn = self._timed(lane, fn, time.perf_counter())
+        self._queues[lane].put(fn)
+
+    @staticmethod
+    def _timed(lane: str, fn: Callable[[], None], queued: float) -> Callable[[], None]:
+        def run() -> None:
+            started = time.perf_counter(); metrics.observe(f"lane {lane} wait", (started - queued) * 1000)
+            try:
+                fn()
+            finally:
+                metrics.observe(f"lane {lane} run", (time.perf_counter() - started) * 1000)
+        return run
+
+    def _worker(self, lane: str) -> None:
+        stats = self._stats[lane]
+        while True:
+            fn = self._queues[lane].get()
+            with self._lock:
+                stats["queued"] -= 1; stats["running"] += 1
+            try:
+                fn()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    stats["running"] -= 1; stats["done"] += 1
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {lane: dict(stats) for lane, stats in self._stats.items()}
+
+
+class UiDispatcher:
+    def __init__(self, wake: Callable[[], None]) -> None:
+        self._items: queue.SimpleQueue[Callable[[], None]] = queue.SimpleQueue()
+        self._wake = wake
+        self._lock = threading.Lock()
+        self._armed = False
+
+    def put(self, fn: Callable[[], None]) -> None:
+        self._items.put(fn)
+        with self._lock:
+            if self._armed:
+                return
+            self._armed = True
+        try:
+            self._wake()
+        except Exception:
+            with self._lock:
+                self._armed = False
+
+    def __len__(self) -> int:
+        return self._items.qsize()
+
+    def drain(self) -> int:
+        with self._lock:
+            self._armed = False
+        handled = 0; t0 = time.perf_counter() if metrics.enabled else 0.0
+        while True:
+            try:
+                fn = self._items.get_nowait()
+            except queue.Empty:
+                if t0 and handled:
+                    metrics.observe("ui drain", (time.perf_counter() - t0) * 1000)
+                return handled
+            try:
+                fn()
+            except Exception:
+                traceback.print_exc()
+            handled += 1
+
+
 def play_sound(ok: bool) -> None:
     try:
         import winsound
@@ -173,29 +1719,139 @@ def play_sound(ok: bool) -> None:
         pass
 
 
+class VirtualTable:
+    def __init__(self, parent: tk.Widget, columns: list[str], headings: list[str], widths: list[int], buffer: int = 4) -> None:
+        container = tk.Frame(parent, bg=CARD); container.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(container, columns=columns, show="headings", selectmode="browse"); self.vsb = ttk.Scrollbar(container, orient="vertical", command=self._on_scrollbar)
+        for c, h, w in zip(columns, headings, widths):
+            self.tree.heading(c, text=h); self.tree.column(c, width=w, anchor="w")
+        self.tree.tag_configure("odd", background=CARD); self.tree.tag_configure("even", background=CARD_ALT); self.tree.tag_configure("error", background="#FDECEC", foreground=RED)
+        self.vsb.pack(side="right", fill="y"); self.tree.pack(side="left", fill="both", expand=True)
+        self.columns = len(columns); self.buffer = buffer; self.row_height = int(ttk.Style(parent).lookup("Treeview", "rowheight") or 20)
+        self.rows: Sequence[tuple[str, ...]] = []; self.view: Sequence[int] = []; self.offset = 0; self.items: list[str] = []
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>", "<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>"):
+            self.tree.bind(seq, self._on_key_or_wheel)
+        self.tree.bind("<Configure>", lambda _e: self._render())
+
+    def winfo_exists(self) -> bool:
+        return bool(self.tree.winfo_exists())
+
+    def set_view(self, rows: Sequence[tuple[str, ...]], view: Sequence[int], keep: bool = False) -> None:
+        self.rows = rows; self.view = view; self.offset = max(0, min(self.offset, len(view) - self._visible())) if keep else 0; self._render()
+
+    def _visible(self) -> int:
+        return max(1, self.tree.winfo_height() // self.row_height - 1)
+
+    def _scroll_to(self, offset: int) -> None:
+        offset = max(0, min(offset, len(self.view) - self._visible()))
+        if offset != self.offset:
+            self.offset = offset; self.tree.selection_remove(*self.tree.selection()); self._render()
+
+    def _on_scrollbar(self, action: str, amount: str, unit: str = "") -> None:
+        if action == "moveto":
+            self._scroll_to(round(float(amount) * len(self.view)))
+        else:
+            self._scroll_to(self.offset + int(amount) * (self._visible() if unit == "pages" else 1))
+
+    def _on_key_or_wheel(self, e: tk.Event) -> str:
+        page = self._visible()
+        step = {"Up": -1, "Down": 1, "Prior": -page, "Next": page, "Home": -len(self.view), "End": len(self.view)}.get(e.keysym)
+        if step is None:
+            step = 3 if e.num == 5 or getattr(e, "delta", 0) < 0 else -3
+        self._scroll_to(self.offset + step); return "break"
+
+    def _render(self) -> None:
+        total = len(self.view); visible = self._visible(); wanted = max(1, min(total, visible + self.buffer))
+        while len(self.items) < wanted: self.items.append(self.tree.insert("", "end", values=("",) * self.columns))
+        while len(self.items) > wanted: self.tree.delete(self.items.pop())
+        if not total:
+            self.tree.item(self.items[0], values=("Немає записів",) + ("—",) * (self.columns - 1), tags=("odd",)); self.vsb.set(0, 1); return
+        for pos, item in enumerate(self.items):
+            idx = self.offset + pos
+            if idx < total: self.tree.item(item, values=self.rows[self.view[idx]], tags=("even" if idx % 2 else "odd",))
+        self.vsb.set(self.offset / total, min(1.0, (self.offset + visible) / total))
+
+
+class RecentScansPanel:
+    """Fixed pool of row widgets for the recent-scans list, updated in place."""
+
+    COLORS = {"ok": GREEN, "dup": AMBER, "offline": AMBER, "err": RED, "pending": BLUE}
+    ICONS = {"ok": "✅", "dup": "⚠", "offline": "📦", "err": "✖", "pending": "⏳"}
+
+    def __init__(self, parent: tk.Widget, size: int) -> None:
+        self.frame = tk.Frame(parent, bg=CARD); self.frame.pack(fill="both", expand=True)
+        self.empty = tk.Label(self.frame, text="Поки що немає сканувань", bg=CARD, fg=MUTED, font=("Segoe UI", 12)); self.empty.pack(anchor="w", pady=8)
+        self.rows: list[tuple[tk.Frame, tk.Label, tk.Label, tk.Label]] = []; self.shown: list[tuple[str, ...] | None] = [None] * size
+        for _ in range(size):
+            row = tk.Frame(self.frame, bg=CARD_ALT)
+            icon = tk.Label(row, bg=CARD_ALT, font=("Segoe UI Emoji", 14)); icon.pack(side="left", padx=(10, 8), pady=8)
+            col = tk.Frame(row, bg=CARD_ALT); col.pack(side="left", fill="x", expand=True, pady=6)
+            number = tk.Label(col, bg=CARD_ALT, fg=TEXT, font=("Segoe UI Semibold", 12, "bold"), anchor="w"); number.pack(anchor="w", fill="x")
+            meta = tk.Label(col, bg=CARD_ALT, fg=MUTED, font=("Segoe UI", 10), anchor="w"); meta.pack(anchor="w", fill="x")
+            self.rows.append((row, icon, number, meta))
+
+    def winfo_exists(self) -> bool:
+        return bool(self.frame.winfo_exists())
+
+    def show(self, entries: Iterable[Sequence[str]]) -> None:
+        entries = [tuple(e) for _, e in zip(self.rows, entries)]
+        if bool(entries) == bool(self.empty.winfo_manager()):
+            self.empty.pack_forget() if entries else self.empty.pack(anchor="w", pady=8)
+        for pos, (row, icon, number, meta) in enumerate(self.rows):
+            entry = entries[pos] if pos < len(entries) else None; old = self.shown[pos]
+            if entry == old:
+                continue
+            self.shown[pos] = entry
+            if entry is None:
+                row.pack_forget(); continue
+            kind, ts, num, note = entry
+            if old is None or old[0] != kind: icon.config(text=self.ICONS.get(kind, "•"), fg=self.COLORS.get(kind, MUTED))
+            if old is None or old[2] != num: number.config(text=num)
+            if old is None or old[1] != ts or old[3] != note: meta.config(text=f"{ts} • {note}")
+            if old is None: row.pack(fill="x", pady=3)
+
+
 class App(tk.Tk):
-    def __init__(self) -> None:
+    def __init__(self, api_url: str = API_BASE_URL) -> None:
         super().__init__()
         self.title(APP_NAME)
         self.geometry("1280x820")
         self.minsize(1080, 720)
         self.configure(bg=BG)
-        self.api = ApiClient()
-        self.offline = OfflineQueue(DB_PATH)
+        self.api = ApiClient(api_url)
+        self.known = DuplicateIndex(DB_PATH)
+        self.offline = OfflineQueue(DB_PATH, self.known)
+        self.mirror = HistoryMirror(DB_PATH, self.known)
+        self.scans = ScanPipeline(self.api, self.known, self.offline, lambda fn: self.tasks.submit("scan", fn))
+        self.syncer = SyncScheduler(self.offline, self.api, lambda sent, err: self.q.put(lambda: self._synced(sent, err)), self._sync_progress)
+        self.api.link.on_up.append(lambda: self.q.put(self._safe_update_queue))
         self.user_name = "operator"
         self.role = "viewer"
-        self.q: queue.Queue[Callable[[], None]] = queue.Queue()
+        self.q = UiDispatcher(lambda: self.event_generate("<<UiWake>>", when="tail"))
+        self.tasks = TaskLanes(TASK_LANES)
         self.nav_buttons: dict[str, tk.Label] = {}
         self.active_page = ""
         self.session_count = 0
         self.session_errors = 0
-        self.local_log: deque[tuple[str, str, str, str]] = deque(maxlen=12)
-        self.history_numbers: set[str] = set()
+        self._last_scan = ""
+        self.local_log: deque[list[str]] = deque(maxlen=12)
+        self.recent: RecentScansPanel | None = None
+        self._status_state: tuple[str, str] | None = None
+        self._dirty: set[str] = set()
+        self._ready = False
+        self._history_snapshot: HistoryStore | None = None
+        self._export_cancel: threading.Event | None = None
+        self._export_btn: ttk.Button | None = None
+        self._export_label: tk.Label | None = None
         self._setup_style()
         self._load_session()
+        self.bind("<<UiWake>>", lambda _e: self.q.drain())
         self.show_main() if self.api.token else self.show_login()
-        self.after(80, self._drain_queue)
-        self.after(15000, self._auto_sync_tick)
+        self.after_idle(lambda: self.after(0, self._warm_start))
+        self.after(UI_HEARTBEAT_MS, self._drain_queue)
+        if metrics.enabled:
+            self.after(METRICS_LAG_PROBE_MS, self._lag_probe, time.perf_counter() + METRICS_LAG_PROBE_MS / 1000)
+            self.after(METRICS_INTERVAL_MS, self._metrics_tick)
 
     def _setup_style(self) -> None:
         s = ttk.Style(self)
@@ -216,26 +1872,55 @@ class App(tk.Tk):
         s.configure("Vertical.TScrollbar", background=CARD_ALT, troughcolor=CARD, borderwidth=0, arrowcolor=MUTED)
 
     def _drain_queue(self) -> None:
-        while True:
-            try:
-                self.q.get_nowait()()
-            except queue.Empty:
-                break
-        self.after(80, self._drain_queue)
-
-    def bg_task(self, work: Callable[[], Any], done: Callable[[Any, Exception | None], None]) -> None:
+        self.q.drain()
+        self.after(UI_HEARTBEAT_MS, self._drain_queue)
+
+    def _warm_start(self) -> None:
+        """Runs once the first frame is up: open the stores and duplicate set, then go online."""
+        def work() -> None:
+            self.offline.open(); self.mirror.open(); self.known.warm()
+            http = self.api.http  # import requests here rather than on the first scan
+            if metrics.enabled: http.hooks.append(metrics.http)
+        def done(_res: Any, err: Exception | None) -> None:
+            self._ready = True; self.syncer.start()
+            if err: traceback.print_exception(err)
+            if getattr(self, "queue_label", None) is not None and self.api.token: self._go_online()
+        self.bg_task(work, done)
+
+    def _go_online(self) -> None:
+        self._safe_update_queue(); self.try_sync(); self._refresh_history_cache()
+
+    def _lag_probe(self, due: float) -> None:
+        now = time.perf_counter(); metrics.observe("ui lag", max(0.0, now - due) * 1000)
+        self.after(METRICS_LAG_PROBE_MS, self._lag_probe, now + METRICS_LAG_PROBE_MS / 1000)
+
+    def _metrics_tick(self) -> None:
+        lanes = self.tasks.stats()
+        snap = metrics.sample(
+            offline=self.offline.count(), ui_queue=len(self.q),
+            lanes={lane: {"queued": st["queued"], "running": st["running"], "peak": st["peak"]} for lane, st in lanes.items()},
+        )
+        self.tasks.submit("misc", lambda: metrics.write(snap))
+        self.after(METRICS_INTERVAL_MS, self._metrics_tick)
+
+    def bg_task(self, work: Callable[[], Any], done: Callable[[Any, Exception | None], None], lane: str = "misc") -> None:
         def run() -> None:
             try:
                 res, err = work(), None
             except Exception as exc:
                 res, err = None, exc
             self.q.put(lambda: done(res, err))
-        threading.Thread(target=run, daemon=True).start()
+        self.tasks.submit(lane, run)
 
     def clear(self) -> None:
+        self._cancel_history()
         for w in self.winfo_children():
             w.destroy()
 
+    def _cancel_history(self) -> None:
+        cancel = getattr(self, "_history_cancel", None)
+        if cancel is not None: cancel.set()
+
     def _load_session(self) -> None:
         if CONFIG_PATH.exists():
             try:
@@ -247,7 +1932,7 @@ class App(tk.Tk):
                 pass
 
     def _save_session(self) -> None:
-        CONFIG_PATH.write_text(json.dumps({"token": self.api.token, "user_name": self.user_name, "role": self.role}, ensure_ascii=False), "utf-8")
+        CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True); CONFIG_PATH.write_text(json.dumps({"token": self.api.token, "user_name": self.user_name, "role": self.role}, ensure_ascii=False), "utf-8")
 
     def show_login(self) -> None:
         self.clear()
@@ -320,7 +2005,10 @@ class App(tk.Tk):
         ucol = tk.Frame(user_card, bg=SIDEBAR_HOVER); ucol.pack(side="left", fill="both", expand=True, pady=10)
         tk.Label(ucol, text=self.user_name, bg=SIDEBAR_HOVER, fg="white", font=("Segoe UI Semibold", 13, "bold"), anchor="w").pack(anchor="w", fill="x")
         tk.Label(ucol, text={"admin": "Адміністратор", "operator": "Оператор"}.get(self.role, "Перегляд"), bg=SIDEBAR_HOVER, fg=MUTED_LIGHT, font=("Segoe UI", 11), anchor="w").pack(anchor="w", fill="x")
-        for key, label, cmd in [("scan", "🔍  Сканування", self.scan_page), ("history", "🗂  Історія", self.history_page)]:
+        pages = [("scan", "🔍  Сканування", self.scan_page), ("history", "🗂  Історія", self.history_page)]
+        if metrics.enabled:
+            pages.append(("diag", "📈  Діагностика", self.diagnostics_page))
+        for key, label, cmd in pages:
             self._make_nav(sidebar, key, label, cmd)
         bottom = tk.Frame(sidebar, bg=SIDEBAR); bottom.pack(side="bottom", fill="x", pady=18, padx=14)
         self.queue_label = tk.Label(bottom, text="", bg=SIDEBAR, fg=AMBER, font=("Segoe UI Semibold", 11, "bold"), anchor="w"); self.queue_label.pack(fill="x", pady=(0, 10))
@@ -328,7 +2016,8 @@ class App(tk.Tk):
         logout_btn.pack(fill="x"); logout_btn.bind("<Button-1>", lambda e: self.logout()); logout_btn.bind("<Enter>", lambda e: logout_btn.config(bg=RED)); logout_btn.bind("<Leave>", lambda e: logout_btn.config(bg=SIDEBAR_HOVER))
         self.content = tk.Frame(root, bg=BG); self.content.pack(side="left", fill="both", expand=True)
         self.body = tk.Frame(self.content, bg=BG); self.body.pack(fill="both", expand=True, padx=28, pady=24)
-        self.scan_page(); self._update_queue_label(); self.try_sync(); self._refresh_history_cache()
+        self.scan_page()
+        if self._ready: self._go_online()
 
     def _make_nav(self, parent: tk.Widget, key: str, label: str, cmd: Callable[[], None]) -> None:
         lbl = tk.Label(parent, text=label, bg=SIDEBAR, fg=TEXT_LIGHT, font=("Segoe UI", 14), anchor="w", padx=22, pady=15, cursor="hand2")
@@ -343,6 +2032,7 @@ class App(tk.Tk):
             lbl.config(bg=SIDEBAR_ACTIVE if k == key else SIDEBAR, fg="white" if k == key else TEXT_LIGHT, font=("Segoe UI Semibold", 14, "bold") if k == key else ("Segoe UI", 14))
 
     def body_clear(self) -> None:
+        self._cancel_history()
         for w in self.body.winfo_children():
             w.destroy()
 
@@ -354,6 +2044,8 @@ class App(tk.Tk):
 
     def _update_queue_label(self) -> None:
         cnt = self.offline.count()
+        if self.api.link.down:
+            self.queue_label.config(text=f"📡 Немає зв'язку — черга: {cnt}", fg=RED); return
         self.queue_label.config(text=f"📦 Офлайн-черга: {cnt}" if cnt else "✅ Дані синхронізовано", fg=AMBER if cnt else GREEN)
 
     def scan_page(self) -> None:
@@ -368,22 +2060,27 @@ class App(tk.Tk):
         self.status = tk.Label(inner, text="Готово — відскануйте номер посилки", bg=BLUE, fg="white", font=("Segoe UI Semibold", 24, "bold"), pady=26); self.status.pack(fill="x", pady=(22, 0))
         log_card = tk.Frame(wrap, bg=CARD); log_card.grid(row=0, column=1, sticky="nsew"); log_inner = tk.Frame(log_card, bg=CARD); log_inner.pack(fill="both", expand=True, padx=20, pady=20)
         tk.Label(log_inner, text="Останні сканування", bg=CARD, fg=TEXT, font=("Segoe UI Semibold", 16, "bold")).pack(anchor="w", pady=(0, 10))
-        self.log_frame = tk.Frame(log_inner, bg=CARD); self.log_frame.pack(fill="both", expand=True); self._render_local_log()
+        self.recent = RecentScansPanel(log_inner, self.local_log.maxlen or 12); self._status_state = None; self._invalidate("log", "counters")
         def submit(_=None) -> None:
             digits = only_digits(number.get()); number.delete(0, "end")
             if not digits:
-                self.status.config(text="Не знайшли цифр у введенні", bg=RED_BG); play_sound(False); number.focus_set(); return
-            if digits in self.history_numbers or self.offline.contains(digits):
-                self.status.config(text="⚠ Дублікат: не збережено", bg=AMBER_BG); self._add_local_log("dup", digits, "Дублікат"); self.session_errors += 1; self._update_counters(); play_sound(False); number.focus_set(); return
-            self.status.config(text="⏳ Надсилання на сервер...", bg=AMBER_BG); number.focus_set()
+                self._set_status("Не знайшли цифр у введенні", RED_BG); play_sound(False); number.focus_set(); return
             def done(res: Any, err: Exception | None) -> None:
-                if err:
-                    self.offline.add(digits); self._update_queue_label(); self.status.config(text=f"📦 Збережено офлайн — черга: {self.offline.count()}", bg=AMBER_BG); self._add_local_log("offline", digits, "Немає зв'язку"); self.session_errors += 1; play_sound(False)
+                latest = self._last_scan == digits
+                if err and not isinstance(err, ApiError):
+                    self._set_local_log(digits, "err", "Не збережено"); self.session_errors += 1; play_sound(False)
+                    if latest: self._set_status(f"✖ Не збережено: {err}", RED_BG)
+                elif err:
+                    self._update_queue_label(); self._set_local_log(digits, "offline", "Немає зв'язку"); self.session_errors += 1; play_sound(False); self.syncer.kick()
+                    if latest: self._set_status(f"📦 Збережено офлайн — черга: {self.offline.count()}", AMBER_BG)
                 else:
                     user = str((res or {}).get("username") or self.user_name); ts = fmt_dt((res or {}).get("scanned_at") or datetime.now().isoformat())
-                    self.history_numbers.add(digits); self.status.config(text=f"✅ Збережено для {user}", bg=GREEN_BG); self._add_local_log("ok", digits, ts); self.session_count += 1; play_sound(True)
+                    self._set_local_log(digits, "ok", ts); self.session_count += 1; play_sound(True)
+                    if latest: self._set_status(f"✅ Збережено для {user}", GREEN_BG)
                 self._update_counters()
-            self.bg_task(lambda: self.api.add_scan(digits), done)
+            if not self.scans.accept(digits, lambda res, err: self.q.put(lambda: done(res, err))):
+                self._set_status("⚠ Дублікат: не збережено", AMBER_BG); self._add_local_log("dup", digits, "Дублікат"); self.session_errors += 1; self._update_counters(); play_sound(False); number.focus_set(); return
+            self._last_scan = digits; self._set_status(f"⏳ Прийнято {digits} — надсилання...", AMBER_BG); self._add_local_log("pending", digits, "Надсилання..."); number.focus_set()
         number.bind("<Return>", submit); number.focus_set()
 
     def _counter_chip(self, parent: tk.Widget, label: str, value: str, color: str) -> tk.Label:
@@ -391,35 +2088,41 @@ class App(tk.Tk):
         val = tk.Label(chip, text=value, bg=CARD_ALT, fg=color, font=("Segoe UI Semibold", 24, "bold")); val.pack(pady=(10, 0))
         tk.Label(chip, text=label, bg=CARD_ALT, fg=MUTED, font=("Segoe UI", 11)).pack(pady=(0, 10)); return val
 
-    def _update_counters(self) -> None:
+    def _invalidate(self, *parts: str) -> None:
+        if not self._dirty:
+            self.after_idle(self._redraw)
+        self._dirty.update(parts)
+
+    def _redraw(self) -> None:
+        dirty, self._dirty = self._dirty, set()
+        if self.active_page != "scan":
+            return
         try:
-            self.lbl_cnt_ok.config(text=str(self.session_count)); self.lbl_cnt_err.config(text=str(self.session_errors))
-        except Exception:
+            if "log" in dirty and self.recent is not None: self.recent.show(self.local_log)
+            if "counters" in dirty: self.lbl_cnt_ok.config(text=str(self.session_count)); self.lbl_cnt_err.config(text=str(self.session_errors))
+            if "status" in dirty and self._status_state: self.status.config(text=self._status_state[0], bg=self._status_state[1])
+        except (tk.TclError, AttributeError):
             pass
 
+    def _set_status(self, text: str, bg: str) -> None:
+        self._status_state = (text, bg); self._invalidate("status")
+
+    def _update_counters(self) -> None:
+        self._invalidate("counters")
+
     def _add_local_log(self, kind: str, number: str, note: str) -> None:
-        self.local_log.appendleft((kind, datetime.now().strftime("%H:%M:%S"), number, note)); self._render_local_log()
+        self.local_log.appendleft([kind, datetime.now().strftime("%H:%M:%S"), number, note]); self._invalidate("log")
 
-    def _render_local_log(self) -> None:
-        for w in self.log_frame.winfo_children():
-            w.destroy()
-        if not self.local_log:
-            tk.Label(self.log_frame, text="Поки що немає сканувань", bg=CARD, fg=MUTED, font=("Segoe UI", 12)).pack(anchor="w", pady=8); return
-        colors = {"ok": GREEN, "dup": AMBER, "offline": AMBER, "err": RED}; icons = {"ok": "✅", "dup": "⚠", "offline": "📦", "err": "✖"}
-        for kind, ts, number, note in self.local_log:
-            row = tk.Frame(self.log_frame, bg=CARD_ALT); row.pack(fill="x", pady=3)
-            tk.Label(row, text=icons.get(kind, "•"), bg=CARD_ALT, fg=colors.get(kind, MUTED), font=("Segoe UI Emoji", 14)).pack(side="left", padx=(10, 8), pady=8)
-            col = tk.Frame(row, bg=CARD_ALT); col.pack(side="left", fill="x", expand=True, pady=6)
-            tk.Label(col, text=number, bg=CARD_ALT, fg=TEXT, font=("Segoe UI Semibold", 12, "bold"), anchor="w").pack(anchor="w", fill="x")
-            tk.Label(col, text=f"{ts} • {note}", bg=CARD_ALT, fg=MUTED, font=("Segoe UI", 10), anchor="w").pack(anchor="w", fill="x")
+    def _set_local_log(self, number: str, kind: str, note: str) -> None:
+        for entry in self.local_log:
+            if entry[0] == "pending" and entry[2] == number:
+                entry[0], entry[3] = kind, note; break
+        else:
+            self.local_log.appendleft([kind, datetime.now().strftime("%H:%M:%S"), number, note])
+        self._invalidate("log")
 
-    def _make_table(self, parent: tk.Widget, columns: list[str], headings: list[str], widths: list[int]) -> ttk.Treeview:
-        container = tk.Frame(parent, bg=CARD); container.pack(fill="both", expand=True)
-        tree = ttk.Treeview(container, columns=columns, show="headings"); vsb = ttk.Scrollbar(container, orient="vertical", command=tree.yview); tree.configure(yscrollcommand=vsb.set)
-        for c, h, w in zip(columns, headings, widths):
-            tree.heading(c, text=h); tree.column(c, width=w, anchor="w")
-        tree.tag_configure("odd", background=CARD); tree.tag_configure("even", background=CARD_ALT); tree.tag_configure("error", background="#FDECEC", foreground=RED)
-        vsb.pack(side="right", fill="y"); tree.pack(side="left", fill="both", expand=True); return tree
+    def _make_table(self, parent: tk.Widget, columns: list[str], headings: list[str], widths: list[int]) -> VirtualTable:
+        return VirtualTable(parent, columns, headings, widths)
 
     def history_page(self) -> None:
         self._set_active_nav("history"); self.body_clear(); self._page_header("Історія сканувань", "Дані завантажуються з /scanpak/history.")
@@ -427,46 +2130,126 @@ class App(tk.Tk):
         search = tk.Entry(bar, textvariable=search_var, font=("Segoe UI", 13), bd=0, relief="flat", bg=CARD, fg=TEXT, insertbackground=BLUE, width=30); search.pack(side="left", ipady=8, padx=(0, 8))
         tk.Label(bar, text="🔎 пошук номера посилки / користувача", bg=BG, fg=MUTED_LIGHT, font=("Segoe UI", 11)).pack(side="left")
         ttk.Button(bar, text="↻ Оновити", style="Small.TButton", command=self.history_page).pack(side="right")
-        tree = self._make_table(self.body, ["dt", "user", "number"], ["Дата і час", "Користувач", "Номер посилки"], [220, 220, 420])
-        self._table_raw: list[dict[str, Any]] = []
-        search_var.trace_add("write", lambda *_a: self._fill_table(tree, self._table_raw, search_var.get()))
-        def loaded(data: Any, err: Exception | None) -> None:
+        self._export_btn = ttk.Button(bar, text="✕ Скасувати експорт" if self._export_cancel else "⬇ Експорт", style="Small.TButton", command=lambda: self._export_history(tree)); self._export_btn.pack(side="right", padx=(0, 8))
+        self._export_label = tk.Label(bar, text="", bg=BG, fg=AMBER, font=("Segoe UI", 11)); self._export_label.pack(side="right", padx=(0, 8))
+        tree = self._make_table(self.body, ["dt", "user", "number"], HISTORY_HEADINGS, [220, 220, 420])
+        self._table_raw = HistoryStore()
+        pending: list[str] = []
+        def on_search(*_a: Any) -> None:
+            if pending: self.after_cancel(pending.pop())
+            pending.append(self.after(SEARCH_DEBOUNCE_MS, lambda: (pending.clear(), self._fill_table(tree, self._table_raw, search_var.get()))))
+        search_var.trace_add("write", on_search)
+        cancel = self._history_cancel = threading.Event()
+        owner = self._history_owner()
+        def loaded(data: Any, err: Exception | None, final: bool = True) -> None:
+            if err or cancel.is_set() or not tree.winfo_exists(): return
+            if not final and search_var.get().strip(): return
+            self._table_raw = data; self._fill_table(tree, self._table_raw, search_var.get(), keep=not final)
+            if final: self._history_snapshot = data
+        snapshot = self._history_snapshot
+        if snapshot is not None: loaded(snapshot, None)
+        def work() -> HistoryStore | None:
+            store = snapshot
+            if store is None: store = HistoryStore.from_rows(self.mirror.rows()); self.q.put(lambda: loaded(store, None))
+            mark = [HISTORY_CHUNK] if not len(store) else []
+            def on_chunk(received: int) -> None:
+                if mark and received >= mark[0]:
+                    mark[0] *= 2; partial = HistoryStore.from_rows(self.mirror.rows()); self.q.put(lambda: loaded(partial, None, False))
+            return HistoryStore.from_rows(self.mirror.rows()) if self.mirror.refresh(self.api, on_chunk, cancel, owner=owner) else None
+        def refreshed(store: Any, err: Exception | None) -> None:
+            if isinstance(err, LoadCancelled): return
             if err:
-                messagebox.showerror(APP_NAME, str(err)); return
-            self._table_raw = data or []; self.history_numbers = {str(r.get("parcel_number") or "").strip() for r in self._table_raw if str(r.get("parcel_number") or "").strip()}; self._fill_table(tree, self._table_raw, "")
-        self.bg_task(self.api.get_history, loaded)
-
-    def _fill_table(self, tree: ttk.Treeview, data: list[dict[str, Any]], query: str) -> None:
-        for item in tree.get_children(): tree.delete(item)
-        q = (query or "").strip().lower(); rows = sorted(data or [], key=lambda x: parse_dt(x.get("scanned_at")), reverse=True); index = 0
-        for r in rows:
-            user = str(r.get("username") or ""); number = str(r.get("parcel_number") or "")
-            if q and q not in f"{user} {number}".lower(): continue
-            tree.insert("", "end", values=(fmt_dt(r.get("scanned_at")), user, number), tags=("even" if index % 2 else "odd",)); index += 1
-        if index == 0: tree.insert("", "end", values=("Немає записів", "—", "—"), tags=("odd",))
+                if not self._table_raw and self.active_page == "history": messagebox.showerror(APP_NAME, str(err))
+                return
+            if store is not None: loaded(store, None)
+        self.bg_task(work, refreshed, "history")
+
+    def _export_history(self, table: VirtualTable) -> None:
+        """Export what the table shows now (current search, newest first); the button cancels a running export."""
+        if self._export_cancel is not None:
+            self._export_cancel.set(); return
+        rows, view = table.rows, table.view
+        if not len(view):
+            messagebox.showinfo(APP_NAME, "Немає рядків для експорту"); return
+        path = filedialog.asksaveasfilename(
+            parent=self, title="Експорт історії", defaultextension=".csv", initialfile=f"scanpak_history_{datetime.now():%Y%m%d_%H%M}.csv",
+            filetypes=[("CSV", "*.csv"), ("Excel", "*.xlsx")],
+        )
+        if not path: return
+        cancel = self._export_cancel = threading.Event(); last = [0.0]
+        def show(text: str, button: str | None = None) -> None:
+            for widget, kw in ((self._export_label, {"text": text}), (self._export_btn, {"text": button} if button else {})):
+                if widget is not None and widget.winfo_exists() and kw: widget.config(**kw)
+        def progress(done: int, total: int) -> None:
+            now = time.monotonic()
+            if now - last[0] < 0.25 and done < total: return
+            last[0] = now; self.q.put(lambda: show(f"Експорт: {done * 100 // total}% ({done}/{total})"))
+        def done(count: Any, err: Exception | None) -> None:
+            self._export_cancel = None; show("", "⬇ Експорт")
+            if isinstance(err, LoadCancelled): return
+            if err: messagebox.showerror(APP_NAME, f"Не вдалося експортувати: {err}")
+            else: messagebox.showinfo(APP_NAME, f"Експортовано {count} рядків у {path}")
+        show("Експорт: 0%", "✕ Скасувати експорт")
+        self.bg_task(lambda: export_history(rows, view, path, HISTORY_HEADINGS, cancel, progress), done, "export")
+
+    def _fill_table(self, table: VirtualTable, model: HistoryStore, query: str, keep: bool = False) -> None:
+        self._search_gen = gen = getattr(self, "_search_gen", 0) + 1; t0 = time.perf_counter() if metrics.enabled else 0.0
+        if model.plan(query) <= SEARCH_INLINE_ROWS:
+            table.set_view(model, model.filter(query), keep)
+            if t0: metrics.observe("ui fill_table", (time.perf_counter() - t0) * 1000)
+            return
+        def done(view: Any, err: Exception | None) -> None:
+            if not err and gen == self._search_gen and table.winfo_exists(): table.set_view(model, view, keep)
+            if t0: metrics.observe("ui fill_table (bg)", (time.perf_counter() - t0) * 1000)
+        self.bg_task(lambda: model.filter(query), done, "search")
+
+    def diagnostics_page(self) -> None:
+        self._set_active_nav("diag"); self.body_clear(); self._page_header("Діагностика", f"Метрики оновлюються кожні {METRICS_INTERVAL_MS // 1000} с і записуються у {METRICS_PATH}.")
+        summary = tk.Label(self.body, text="Збір даних...", bg=CARD, fg=TEXT, font=("Consolas", 12), justify="left", anchor="w", padx=16, pady=12); summary.pack(fill="x", pady=(0, 12))
+        table = self._make_table(self.body, ["name", "count", "p50", "p95", "max"], ["Метрика", "Кількість", "p50, мс", "p95, мс", "max, мс"], [340, 110, 110, 110, 110])
+        def refresh() -> None:
+            if self.active_page != "diag" or not table.winfo_exists(): return
+            snap = metrics.samples[-1] if metrics.samples else None
+            if snap:
+                offline = " → ".join(str(s["offline"]) for s in list(metrics.samples)[-8:])
+                lanes = ", ".join(f"{lane} {st['running']}+{st['queued']}" for lane, st in snap["lanes"].items())
+                summary.config(text=f"{snap['ts']}\nОфлайн-черга: {offline}\nСинхронізація: {snap['sync_per_s']} запис/с\nВоркери (працює+черга): {lanes}; UI-черга: {snap['ui_queue']}")
+            rows = [(name, str(h["count"]), f"{h['p50_ms']:g}", f"{h['p95_ms']:g}", f"{h['max_ms']:g}") for name, h in sorted(metrics.latency().items())]
+            table.set_view(rows, range(len(rows)), keep=True); self.after(2000, refresh)
+        refresh()
+
+    def _history_owner(self) -> str:
+        return f"{self.api.base_url}|{self.user_name}"
 
     def _refresh_history_cache(self) -> None:
-        def loaded(data: Any, err: Exception | None) -> None:
-            if not err:
-                self.history_numbers = {str(r.get("parcel_number") or "").strip() for r in (data or []) if str(r.get("parcel_number") or "").strip()}
-        self.bg_task(self.api.get_history, loaded)
+        owner = self._history_owner()
+        def keep(store: Any, err: Exception | None = None) -> None:
+            if not err and store is not None: self._history_snapshot = store
+        def work() -> HistoryStore | None:
+            if self._history_snapshot is None:
+                cached = HistoryStore.from_rows(self.mirror.rows()); self.q.put(lambda: keep(cached) if self._history_snapshot is None else None)
+            return HistoryStore.from_rows(self.mirror.rows()) if self.mirror.refresh(self.api, owner=owner) else None
+        self.bg_task(work, keep, "history")
+
+    def _sync_progress(self) -> Callable[[int, int], None]:
+        last = [0.0]
+        def report(sent: int, total: int) -> None:
+            now = time.monotonic()
+            if now - last[0] < 0.25 and sent < total: return
+            last[0] = now
+            def show() -> None:
+                try: self.queue_label.config(text=f"☁ Синхронізація: {sent}/{total}", fg=AMBER)
+                except Exception: pass
+            self.q.put(show)
+        return report
 
     def try_sync(self) -> None:
-        if self.offline.count():
-            def done(sent: Any, err: Exception | None) -> None:
-                self._update_queue_label()
-                if not err and sent and self.active_page == "scan":
-                    try: self.status.config(text=f"☁ Синхронізовано {sent} запис(ів)", bg=GREEN_BG)
-                    except Exception: pass
-            self.bg_task(lambda: self.offline.sync(self.api), done)
-
-    def _auto_sync_tick(self) -> None:
-        if getattr(self, "queue_label", None) is not None:
-            try: self._update_queue_label()
-            except Exception: pass
-            if self.api.token and self.offline.count():
-                self.bg_task(lambda: self.offline.sync(self.api), lambda _s, _e: self._safe_update_queue())
-        self.after(15000, self._auto_sync_tick)
+        self.syncer.kick()
+
+    def _synced(self, sent: int, err: Exception | None) -> None:
+        self._safe_update_queue()
+        if not err and sent and self.active_page == "scan":
+            self._set_status(f"☁ Синхронізовано {sent} запис(ів)", GREEN_BG)
 
     def _safe_update_queue(self) -> None:
         try: self._update_queue_label()
@@ -475,8 +2258,66 @@ class App(tk.Tk):
     def logout(self) -> None:
         if messagebox.askyesno(APP_NAME, "Вийти з акаунту?"):
             self.api.token = ""; CONFIG_PATH.unlink(missing_ok=True); self.nav_buttons.clear(); self.active_page = ""; self.show_login()
+            self._history_snapshot = None; self.bg_task(self.mirror.clear, lambda _res, _err: None, "history")  # the next account must not see these rows
+
+
+def _attach_console_log() -> None:
+    """A --windowed build starts with sys.stdout/sys.stderr set to None; send that output to CONSOLE_LOG_PATH."""
+    if sys.stdout is not None and sys.stderr is not None:
+        return
+    try:
+        CONSOLE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        log = open(CONSOLE_LOG_PATH, "a", encoding="utf-8", errors="replace", buffering=1)
+    except OSError:
+        log = open(os.devnull, "w", encoding="utf-8")
+    sys.stdout = sys.stdout or log; sys.stderr = sys.stderr or log
+    print(f"--- {datetime.now().isoformat(timespec='seconds')} {' '.join(sys.argv)}", file=log)
+
+
+def _print_progress(s: dict[str, Any]) -> None:
+    print(f"… рядків {s['rows']}, надіслано {s['sent']}, офлайн {s['offline']}, {s['per_s']}/с", file=sys.stderr, flush=True)
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    _attach_console_log()
+    parser = argparse.ArgumentParser(description=f"{APP_NAME}: без аргументів запускає застосунок.")
+    parser.add_argument("--import", dest="import_path", metavar="FILE", help="надіслати номери з CSV/TXT файлу ('-' — stdin) без інтерфейсу")
+    parser.add_argument("--column", type=int, help="колонка з номером (з 1); за замовчуванням — клітинка з найбільшою кількістю цифр")
+    parser.add_argument("--workers", type=int, default=TASK_LANES["scan"], help="паралельних запитів")
+    parser.add_argument("--rate", type=float, default=IMPORT_RATE, help="максимум номерів за секунду (0 — без обмеження)")
+    parser.add_argument("--metrics", action="store_true", default=os.getenv("SCANPAK_METRICS", "").strip().lower() in {"1", "true", "yes", "on"}, help=f"збирати метрики продуктивності у {METRICS_PATH.name}")
+    parser.add_argument("--api", default=API_BASE_URL, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+    if not args.import_path:
+        App(args.api).mainloop(); return
+    if args.column is not None and args.column < 1:
+        parser.error("--column починається з 1")
+    try:
+        token = str(json.loads(CONFIG_PATH.read_text("utf-8")).get("token") or "")
+    except (OSError, ValueError):
+        token = ""
+    if not token:
+        parser.error("немає збереженої сесії — спершу увійдіть у застосунку")
+    api = ApiClient(args.api, Transport(pool_size=args.workers + 1)); api.token = token
+    if metrics.enabled:
+        api.http.hooks.append(metrics.http)
+    index = DuplicateIndex(DB_PATH); index.warm(); offline = OfflineQueue(DB_PATH, index)
+    try:
+        s = bulk_import(args.import_path, api, index, offline, args.workers, args.rate, None if args.column is None else args.column - 1, _print_progress)
+    except OSError as exc:
+        parser.exit(1, f"Не вдалося прочитати файл: {exc}\n")
+    print(
+        f"Рядків: {s['rows']}; без номера: {s['empty']}; дублікатів: {s['duplicates']}\n"
+        f"Надіслано: {s['sent']}; в офлайн-черзі: {s['offline']} (усього в черзі: {offline.count()}); не збережено: {s['failed']}\n"
+        f"Час: {s['elapsed_s']} с; швидкість: {s['per_s']} номерів/с" + ("\nПерервано користувачем" if s["interrupted"] else "")
+    )
+    if metrics.enabled:
+        metrics.write(metrics.sample(offline=offline.count(), import_summary=s))
+    if s["interrupted"] or s["offline"] or s["failed"]:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    app = App()
-    app.mainloop()
+    main()